@@ -1,11 +1,10 @@
 """词云"""
 
+import asyncio
 import re
 from datetime import datetime, timedelta
-from io import BytesIO
 from typing import Any
 
-import PIL.Image
 from nonebot import require
 
 require("nonebot_plugin_apscheduler")
@@ -38,25 +37,42 @@ from nonebot_plugin_alconna import (
     on_alconna,
     store_true,
 )
-from nonebot_plugin_chatrecorder import get_messages_plain_text
 from nonebot_plugin_uninfo import Session, UniSession
 
 from . import permissions
+from .analyzer import analyzer_pool
+from .cache import wordcloud_cache
 from .config import Config, plugin_config
-from .data_source import get_wordcloud
+from .data_source import (
+    get_render_preset,
+    get_wordcloud,
+    get_wordcloud_cache_key,
+    remove_mask,
+    save_mask,
+    start_token_purge,
+    start_warm_up,
+)
 from .model import ScheduleMode, ScheduleType
+from .render import render_limiter, render_pool
+from .rollup import iter_message_batches, start_rollup
 from .schedule import schedule_service
 from .utils import (
     ensure_group,
     get_current_period_range,
     get_datetime_fromisoformat_with_timezone,
     get_datetime_now_with_timezone,
+    get_image_segment,
     get_mask_key,
     get_previous_period_range,
     get_time_fromisoformat_with_timezone,
 )
 
 get_driver().on_startup(schedule_service.update)
+get_driver().on_startup(start_warm_up)
+get_driver().on_startup(start_rollup)
+get_driver().on_startup(start_token_purge)
+get_driver().on_shutdown(render_pool.shutdown)
+get_driver().on_shutdown(analyzer_pool.shutdown)
 
 
 def _get_permission_required_message(permission: str, action: str) -> str:
@@ -441,19 +457,37 @@ async def handle_wordcloud(
                 )
             )
 
-    messages = await get_messages_plain_text(
-        session=session,
-        filter_user=filter_user,
-        filter_self_id=False,
-        filter_adapter=False,
-        types=["message"],  # 排除机器人自己发的消息
-        time_start=start,
-        time_stop=stop,
-        user_ids=user_ids,
-        exclude_user_ids=plugin_config.wordcloud_exclude_user_ids,
+    async def create_wordcloud() -> bytes | None:
+        queue_notice = plugin_config.wordcloud_render_queue_notice
+        if queue_notice and (position := render_limiter.get_position()) >= queue_notice:
+            await wordcloud_cmd.send(
+                f"当前生成词云的请求较多，已加入队列，排在第 {position} 位",
+                at_sender=at_sender,
+                reply=plugin_config.wordcloud_reply_message,
+            )
+        messages = iter_message_batches(
+            session=session,
+            filter_user=filter_user,
+            filter_self_id=False,
+            filter_adapter=False,
+            types=["message"],  # 排除机器人自己发的消息
+            time_start=start,
+            time_stop=stop,
+            user_ids=user_ids,
+            exclude_user_ids=plugin_config.wordcloud_exclude_user_ids,
+        )
+        return await get_wordcloud(
+            messages, mask_key, preset=get_render_preset(mask_key, start, stop)
+        )
+
+    cache_key, cache_ttl = get_wordcloud_cache_key(
+        mask_key, start, stop, [session.user.id] if filter_user else user_ids
+    )
+    image = await wordcloud_cache.get_or_create(
+        cache_key, create_wordcloud, ttl=cache_ttl
     )
 
-    if not (image := await get_wordcloud(messages, mask_key)):
+    if not image:
         await wordcloud_cmd.finish(
             "没有足够的数据生成词云",
             at_sender=at_sender,
@@ -461,7 +495,7 @@ async def handle_wordcloud(
         )
 
     await wordcloud_cmd.finish(
-        Image(raw=image, name="wordcloud.png"),
+        get_image_segment(image, "wordcloud"),
         at_sender=at_sender,
         reply=plugin_config.wordcloud_reply_message,
     )
@@ -551,7 +585,6 @@ async def handle_save_mask(
     if image is None:
         await set_mask_cmd.reject("请发送一张图片作为词云形状")
 
-    mask = PIL.Image.open(BytesIO(image))
     if default.result:
         if not await permissions.default_mask_permission(bot, event):
             await set_mask_cmd.finish(
@@ -560,7 +593,7 @@ async def handle_save_mask(
                     "设置词云默认形状",
                 )
             )
-        mask.save(plugin_config.get_mask_path(), format="PNG")
+        await asyncio.to_thread(save_mask, image)
         await set_mask_cmd.finish("词云默认形状设置成功")
     else:
         if not await permissions.mask_permission(bot, event):
@@ -570,7 +603,7 @@ async def handle_save_mask(
                     "设置词云形状",
                 )
             )
-        mask.save(plugin_config.get_mask_path(mask_key), format="PNG")
+        await asyncio.to_thread(save_mask, image, mask_key)
         await set_mask_cmd.finish("词云形状设置成功")
 
 
@@ -620,8 +653,7 @@ async def _(
                     "删除词云默认形状",
                 )
             )
-        mask_path = plugin_config.get_mask_path()
-        mask_path.unlink(missing_ok=True)
+        remove_mask()
         await remove_mask_cmd.finish("词云默认形状已删除")
     else:
         if not await permissions.mask_permission(bot, event):
@@ -631,8 +663,7 @@ async def _(
                     "删除词云形状",
                 )
             )
-        mask_path = plugin_config.get_mask_path(mask_key)
-        mask_path.unlink(missing_ok=True)
+        remove_mask(mask_key)
         await remove_mask_cmd.finish("词云形状已删除")
 
 
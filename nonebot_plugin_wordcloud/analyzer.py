@@ -1,42 +1,251 @@
 from __future__ import annotations
 
+import asyncio
+import multiprocessing
+import re
+import threading
+from abc import ABC, abstractmethod
 from collections import Counter
-from typing import TYPE_CHECKING, Protocol
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from itertools import chain
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Protocol, TypeVar
 
 from nonebot import logger
+from nonebot.compat import model_dump
 
-from .config import plugin_config
+from .cache import get_file_signature
+from .config import global_config, plugin_config
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Callable, Iterable, Iterator
     from pathlib import Path
 
+T = TypeVar("T")
+
+NUMERIC_WORD_PATTERN = r"[\d.,:%+\-]+"
+"""只由数字和数字中常见的符号组成的词语"""
+
+
+class TokenFilter:
+    """筛选分词结果的规则，所有分析后端共用。
+
+    规则在配置变化时才重新创建，筛选时只使用预先编译的正则表达式和
+    不可变的停用词集合。
+    """
+
+    def __init__(
+        self,
+        stopwords: frozenset[str] = frozenset(),
+        *,
+        min_length: int = 2,
+        exclude_words: tuple[str, ...] = (),
+        exclude_numeric: bool = False,
+    ):
+        """创建词语筛选规则。
+
+        Args:
+            stopwords: 小写的停用词。
+            min_length: 保留的最小词长。
+            exclude_words: 需要排除的词语的正则表达式，需要完整匹配。
+            exclude_numeric: 是否排除只由数字组成的词语。
+        """
+        self.stopwords = stopwords
+        self.min_length = max(min_length, 1)
+        # 与 str.isalnum 一致，不包括下划线
+        self._has_alnum = re.compile(r"[^\W_]").search
+        patterns = list(exclude_words)
+        if exclude_numeric:
+            patterns.append(NUMERIC_WORD_PATTERN)
+        self._is_excluded = (
+            re.compile("|".join(f"(?:{pattern})" for pattern in patterns)).fullmatch
+            if patterns
+            else None
+        )
+
+    def __call__(self, words: Iterable[str]) -> Iterator[str]:
+        """筛选词语。
+
+        去除首尾空白后，丢弃过短、不含字母或数字（如纯标点）、在停用词中
+        或被排除的词语。
+
+        Args:
+            words: 分词结果。
+
+        Yields:
+            保留的词语。
+        """
+        min_length = self.min_length
+        stopwords = self.stopwords
+        has_alnum = self._has_alnum
+        is_excluded = self._is_excluded
+        for word in words:
+            word = word.strip()
+            if (
+                len(word) >= min_length
+                and has_alnum(word)
+                and word.lower() not in stopwords
+                and not (is_excluded and is_excluded(word))
+            ):
+                yield word
+
+
+@lru_cache(maxsize=8)
+def _create_token_filter(
+    stopwords: frozenset[str],
+    min_length: int,
+    exclude_words: tuple[str, ...],
+    exclude_numeric: bool,
+) -> TokenFilter:
+    return TokenFilter(
+        stopwords,
+        min_length=min_length,
+        exclude_words=exclude_words,
+        exclude_numeric=exclude_numeric,
+    )
+
+
+def get_token_filter(stopwords: frozenset[str] = frozenset()) -> TokenFilter:
+    """获取与当前配置一致的词语筛选规则。
+
+    Args:
+        stopwords: 分析后端加载的小写停用词。
+
+    Returns:
+        词语筛选规则，配置不变时复用同一个实例。
+    """
+    return _create_token_filter(
+        stopwords,
+        plugin_config.wordcloud_min_word_length,
+        tuple(plugin_config.wordcloud_exclude_words),
+        plugin_config.wordcloud_exclude_numeric_words,
+    )
+
 
 class WordAnalyzer(Protocol):
-    """分析消息文本并返回词云使用的词权重。"""
+    """分析消息文本并返回词云使用的词权重。
+
+    ``cut`` 把一条消息切分为有效词语；``count`` 逐条分词并合并各词语出现的
+    次数，多批消息的结果可以直接相加；``weigh`` 再把累计的次数换算成词云
+    使用的权重。
+    """
+
+    def cut(self, text: str) -> Iterable[str]: ...
+
+    def count(self, messages: Iterable[str]) -> Counter[str]: ...
+
+    def weigh(self, counts: Counter[str]) -> dict[str, float]: ...
 
     def analyse(self, text: str) -> dict[str, float]: ...
 
+    def analyse_messages(self, messages: Iterable[str]) -> dict[str, float]: ...
+
+
+class BaseAnalyzer(ABC):
+    """分析后端的公共实现，子类只需实现 ``cut`` 和 ``weigh``。"""
+
+    stopwords: frozenset[str] = frozenset()
+    """小写的停用词"""
+
+    @abstractmethod
+    def cut(self, text: str) -> Iterable[str]:
+        """对单条消息分词。"""
+
+    def filter_words(self, words: Iterable[str]) -> Iterator[str]:
+        """使用当前配置的筛选规则筛选分词结果。"""
+        return get_token_filter(self.stopwords)(words)
+
+    @abstractmethod
+    def weigh(self, counts: Counter[str]) -> dict[str, float]:
+        """根据词频计算词语权重。"""
+
+    def count(self, messages: Iterable[str]) -> Counter[str]:
+        """逐条分词并合并词频，词语不会跨越消息的边界。"""
+        return Counter(chain.from_iterable(map(self.cut, messages)))
 
-class JiebaAnalyzer:
     def analyse(self, text: str) -> dict[str, float]:
+        return self.weigh(self.count([text]))
+
+    def analyse_messages(self, messages: Iterable[str]) -> dict[str, float]:
+        return self.weigh(self.count(messages))
+
+
+class JiebaAnalyzer(BaseAnalyzer):
+    def __init__(
+        self,
+        stopwords_path: Path | None = None,
+        userdict_path: Path | None = None,
+    ):
+        """加载 jieba 分词器、IDF 表、停用词和用户词典。
+
+        每个实例拥有独立的分词器与关键词提取器，避免用户词典和停用词
+        污染 jieba 的全局默认实例。
+
+        Args:
+            stopwords_path: 停用词表路径。
+            userdict_path: 用户词典路径。
+        """
         import jieba
         import jieba.analyse
+        import jieba.posseg
 
-        if plugin_config.wordcloud_stopwords_path:
-            jieba.analyse.set_stop_words(str(plugin_config.wordcloud_stopwords_path))
-        if plugin_config.wordcloud_userdict_path:
-            jieba.load_userdict(str(plugin_config.wordcloud_userdict_path))
+        self.tokenizer = jieba.Tokenizer()
+        self.tokenizer.initialize()
+        if userdict_path:
+            self.tokenizer.load_userdict(str(userdict_path))
 
-        options = dict(plugin_config.wordcloud_analyzer_options)
-        top_k = options.pop("top_k", options.pop("topK", 0))
-        options.pop("withWeight", None)
-        words = jieba.analyse.extract_tags(text, topK=top_k, withWeight=True, **options)
-        return dict(words)
+        self.extractor = jieba.analyse.TFIDF()
+        self.extractor.tokenizer = self.tokenizer
+        self.extractor.postokenizer = jieba.posseg.POSTokenizer(self.tokenizer)
+        if stopwords_path:
+            self.extractor.set_stop_words(str(stopwords_path))
+        self.stopwords = frozenset(word.lower() for word in self.extractor.stop_words)
 
+    def cut(self, text: str) -> Iterable[str]:
+        """分词并筛选词语，与 ``TFIDF.extract_tags`` 一样支持按词性筛选。"""
+        options = plugin_config.wordcloud_analyzer_options
+        if allow_pos := frozenset(options.get("allowPOS", ())):
+            words = (
+                pair.word
+                for pair in self.extractor.postokenizer.cut(text)
+                if pair.flag in allow_pos
+            )
+        else:
+            words = self.tokenizer.cut(text)
+        return self.filter_words(words)
 
-class RjiebaAnalyzer:
-    def analyse(self, text: str) -> dict[str, float]:
+    def weigh(self, counts: Counter[str]) -> dict[str, float]:
+        """按 TF-IDF 计算权重，并保留权重最高的 ``top_k`` 个词语。"""
+        options = plugin_config.wordcloud_analyzer_options
+        top_k = options.get("top_k", options.get("topK", 0))
+        total = sum(counts.values())
+        idf_freq = self.extractor.idf_freq
+        median_idf = self.extractor.median_idf
+        words = sorted(
+            (
+                (word, count * idf_freq.get(word, median_idf) / total)
+                for word, count in counts.items()
+            ),
+            key=itemgetter(1),
+            reverse=True,
+        )
+        return dict(words[:top_k] if top_k else words)
+
+
+class RjiebaAnalyzer(BaseAnalyzer):
+    def __init__(
+        self,
+        stopwords_path: Path | None = None,
+        userdict_path: Path | None = None,
+    ):
+        """加载 rjieba 分词器和停用词。
+
+        Args:
+            stopwords_path: 停用词表路径。
+            userdict_path: 用户词典路径，rjieba 暂不支持，仅用于给出警告。
+        """
         try:
             import rjieba
         except ImportError as e:
@@ -45,34 +254,201 @@ class RjiebaAnalyzer:
                 "请安装 nonebot-plugin-wordcloud[rjieba]。"
             ) from e
 
-        if plugin_config.wordcloud_userdict_path:
+        if userdict_path:
             logger.warning(
                 "rjieba 分析后端暂不支持 wordcloud_userdict_path，已忽略用户词典"
             )
 
-        segmenter = rjieba.Jieba()
+        self.segmenter = rjieba.Jieba()
+        self.stopwords = frozenset(
+            word.lower() for word in _load_word_file(stopwords_path)
+        )
+
+    def cut(self, text: str) -> Iterable[str]:
         options = plugin_config.wordcloud_analyzer_options
         mode = str(options.get("mode", "default")).lower()
         hmm = bool(options.get("hmm", True))
         match mode:
             case "all":
-                words = segmenter.cut_all(text)
+                words = self.segmenter.cut_all(text)
             case "search":
-                words = segmenter.cut_for_search(text, hmm)
+                words = self.segmenter.cut_for_search(text, hmm)
             case _:
-                words = segmenter.cut(text, hmm)
-        return _count_words(words)
+                words = self.segmenter.cut(text, hmm)
+        return self.filter_words(words)
 
+    def weigh(self, counts: Counter[str]) -> dict[str, float]:
+        return {word: float(count) for word, count in counts.items()}
 
-def get_word_analyzer() -> WordAnalyzer:
-    analyzer = plugin_config.wordcloud_analyzer
-    match analyzer:
-        case "jieba":
-            return JiebaAnalyzer()
-        case "rjieba":
-            return RjiebaAnalyzer()
-        case _:
+
+ANALYZERS: dict[str, type[BaseAnalyzer]] = {
+    "jieba": JiebaAnalyzer,
+    "rjieba": RjiebaAnalyzer,
+}
+
+
+class AnalyzerRegistry:
+    """缓存已加载词典的分析器实例。
+
+    分析器会在第一次使用时创建，之后在请求之间复用；只有当分析后端或
+    停用词表、用户词典文件发生变化时才会重新加载。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key: tuple | None = None
+        self._analyzer: WordAnalyzer | None = None
+
+    @staticmethod
+    def get_key() -> tuple:
+        """根据当前配置生成分析器缓存 key。
+
+        Returns:
+            由分析后端和词典文件状态组成的 key。
+        """
+        return (
+            plugin_config.wordcloud_analyzer,
+            get_file_signature(plugin_config.wordcloud_stopwords_path),
+            get_file_signature(plugin_config.wordcloud_userdict_path),
+        )
+
+    def get(self) -> WordAnalyzer:
+        """获取与当前配置一致的分析器，必要时重新加载。
+
+        Returns:
+            当前配置对应的分析器。
+        """
+        key = self.get_key()
+        with self._lock:
+            if self._analyzer is None or self._key != key:
+                self._analyzer = self._create(key[0])
+                self._key = key
+                logger.debug(f"已加载词云分析后端: {key[0]}")
+            return self._analyzer
+
+    def clear(self) -> None:
+        """丢弃缓存的分析器，下一次使用时重新加载。"""
+        with self._lock:
+            self._key = None
+            self._analyzer = None
+
+    @staticmethod
+    def _create(analyzer: str) -> WordAnalyzer:
+        if (analyzer_class := ANALYZERS.get(analyzer)) is None:
             raise ValueError(f"不支持的词云分析后端: {analyzer}")
+        return analyzer_class(
+            plugin_config.wordcloud_stopwords_path,
+            plugin_config.wordcloud_userdict_path,
+        )
+
+
+analyzer_registry = AnalyzerRegistry()
+
+
+def get_word_analyzer() -> WordAnalyzer:
+    return analyzer_registry.get()
+
+
+def warm_up_analyzer() -> None:
+    """提前加载当前配置的分析器，并完成一次分词以初始化延迟加载的模型。"""
+    get_word_analyzer().analyse("词云预热")
+
+
+_WORKER_INITIALIZER = """
+import nonebot
+
+nonebot.init(**config)
+
+from nonebot_plugin_wordcloud.analyzer import warm_up_analyzer
+
+warm_up_analyzer()
+"""
+"""分词子进程的初始化代码。
+
+子进程需要先初始化 NoneBot 才能导入插件，初始化函数不能定义在插件中，
+因此通过 ``exec`` 执行，初始化后再导入插件并预热分析器。
+"""
+
+
+class AnalyzerPool:
+    """在子进程中并行分词的工作池。
+
+    工作池在第一次使用时创建，每个子进程启动时在初始化函数中预热分析器，
+    之后的任务复用已经加载的词典。子进程数量由 ``wordcloud_analyzer_workers``
+    设置。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+        self._workers = 0
+
+    @property
+    def enabled(self) -> bool:
+        return plugin_config.wordcloud_analyzer_workers > 0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """获取当前工作池，不存在或子进程数量变化时重新创建。
+
+        Returns:
+            当前使用的进程池。
+        """
+        workers = plugin_config.wordcloud_analyzer_workers
+        with self._lock:
+            if self._executor is not None and self._workers != workers:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                # 使用 spawn 避免在多线程的事件循环进程中 fork
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=partial(
+                        exec,
+                        _WORKER_INITIALIZER,
+                        {"config": model_dump(global_config)},
+                    ),
+                )
+                self._workers = workers
+            return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """在子进程中执行同步函数，子进程意外退出时使用新的工作池重试一次。
+
+        Args:
+            func: 需要执行的同步函数。
+            args: 传递给函数的位置参数。
+
+        Returns:
+            函数的返回值。
+        """
+        try:
+            return await self._run(func, *args)
+        except BrokenProcessPool:
+            logger.warning("分词子进程意外退出，使用新的工作池重试")
+            return await self._run(func, *args)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                if executor is self._executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self) -> None:
+        """关闭工作池，取消尚未开始的任务。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+analyzer_pool = AnalyzerPool()
 
 
 def analyse_message(msg: str) -> dict[str, float]:
@@ -80,27 +456,6 @@ def analyse_message(msg: str) -> dict[str, float]:
     return get_word_analyzer().analyse(msg)
 
 
-def _count_words(words: Iterable[str]) -> dict[str, float]:
-    stopwords = _load_word_file(plugin_config.wordcloud_stopwords_path)
-    counter = Counter(word for word in _iter_valid_words(words, stopwords))
-    return {word: float(count) for word, count in counter.items()}
-
-
-def _iter_valid_words(
-    words: Iterable[str],
-    stopwords: set[str],
-) -> Iterable[str]:
-    for word in words:
-        word = word.strip()
-        if (
-            word
-            and len(word) >= plugin_config.wordcloud_min_word_length
-            and word not in stopwords
-            and any(char.isalnum() for char in word)
-        ):
-            yield word
-
-
 def _load_word_file(path: Path | None) -> set[str]:
     if not path:
         return set()
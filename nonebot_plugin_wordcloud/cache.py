@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TypeVar
+
+from nonebot import logger
+
+from .config import plugin_config
+
+T = TypeVar("T")
+
+
+def get_file_signature(path: Path | None) -> tuple | None:
+    """获取文件的路径与修改状态，用于判断文件是否变化。
+
+    Args:
+        path: 文件路径。
+
+    Returns:
+        由路径、修改时间和大小组成的元组；路径为空时返回 None。
+    """
+    if not path:
+        return None
+    try:
+        stat = path.stat()
+    except OSError:
+        return (str(path), None, None)
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def get_cache_key(*parts: Any) -> str:
+    """将任意可序列化的内容转换为缓存 key。
+
+    Args:
+        parts: 组成缓存 key 的内容。
+
+    Returns:
+        内容的 SHA-256 十六进制摘要。
+    """
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class SingleFlight:
+    """合并相同 key 的并发任务。
+
+    同一时间相同 key 只会执行一次任务，其余调用者等待同一个结果。
+    单个调用者被取消不会影响正在执行的任务。
+    """
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """执行任务，若已有相同 key 的任务正在执行则等待其结果。
+
+        Args:
+            key: 任务 key。
+            func: 创建任务协程的函数，仅在没有相同任务时调用。
+
+        Returns:
+            任务的返回值。
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda task: self._discard(key, task))
+        return await asyncio.shield(task)
+
+    def _discard(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+class FallbackImage(bytes):
+    """渲染超时后使用简化参数生成的词云图片。
+
+    只在内存中按 ``wordcloud_cache_ttl`` 短暂缓存，不会写入磁盘，
+    之后的请求会重新尝试完整渲染。
+    """
+
+
+@dataclass
+class CacheEntry:
+    data: bytes
+    expire_at: float | None
+    """过期时间，为空时永不过期"""
+
+
+class WordcloudCache:
+    """词云图片缓存。
+
+    内存中按字节数进行 LRU 淘汰；不会过期的缓存（已经结束的时间段）
+    还可以保存到数据目录下，重启后继续使用。内存与磁盘缓存分别按各自的
+    容量开启，读写磁盘在工作线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._size = 0
+        self._single_flight = SingleFlight()
+
+    @property
+    def size(self) -> int:
+        """内存中缓存的总字节数。"""
+        return self._size
+
+    async def get(self, key: str) -> bytes | None:
+        """获取缓存的图片。
+
+        Args:
+            key: 缓存 key。
+
+        Returns:
+            缓存的图片字节；不存在或已过期时返回 None。
+        """
+        if entry := self._entries.get(key):
+            if entry.expire_at is None or entry.expire_at > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry.data
+            self._pop(key)
+
+        if plugin_config.wordcloud_cache_disk_size:
+            path = plugin_config.get_cache_path(key)
+            try:
+                data = await asyncio.to_thread(path.read_bytes)
+            except OSError:
+                return None
+            self._put(key, CacheEntry(data, None))
+            return data
+
+    async def set(self, key: str, data: bytes, *, ttl: float | None = None) -> None:
+        """保存图片到缓存。
+
+        Args:
+            key: 缓存 key。
+            data: 图片字节。
+            ttl: 缓存有效秒数，为空时永不过期；为 0 时不缓存。
+        """
+        if isinstance(data, FallbackImage):
+            fallback_ttl = plugin_config.wordcloud_cache_ttl
+            ttl = fallback_ttl if ttl is None else min(ttl, fallback_ttl)
+        if ttl is not None and ttl <= 0:
+            return
+        expire_at = None if ttl is None else time.monotonic() + ttl
+        self._put(key, CacheEntry(data, expire_at))
+        if expire_at is None and plugin_config.wordcloud_cache_disk_size:
+            await asyncio.to_thread(self._save, key, data)
+
+    async def get_or_create(
+        self,
+        key: str,
+        create: Callable[[], Awaitable[bytes | None]],
+        *,
+        ttl: float | None = None,
+    ) -> bytes | None:
+        """获取缓存的图片，不存在时生成并缓存。
+
+        相同 key 的并发请求只会生成一次图片。
+
+        Args:
+            key: 缓存 key。
+            create: 生成图片的异步函数。
+            ttl: 缓存有效秒数，为空时永不过期。
+
+        Returns:
+            图片字节；无法生成时返回 None。
+        """
+        if (data := await self.get(key)) is not None:
+            return data
+
+        async def _create() -> bytes | None:
+            if data := await create():
+                await self.set(key, data, ttl=ttl)
+            return data
+
+        return await self._single_flight.run(key, _create)
+
+    def clear(self) -> None:
+        """清空内存中的缓存。"""
+        self._entries.clear()
+        self._size = 0
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        max_size = plugin_config.wordcloud_cache_size * 1024 * 1024
+        self._pop(key)
+        if not max_size or len(entry.data) > max_size:
+            return
+        self._entries[key] = entry
+        self._size += len(entry.data)
+        while self._size > max_size:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= len(entry.data)
+
+    def _save(self, key: str, data: bytes) -> None:
+        """写入磁盘缓存，并按修改时间删除超出容量的旧文件。"""
+        path = plugin_config.get_cache_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_bytes(data)
+            temp_path.replace(path)
+
+            max_size = plugin_config.wordcloud_cache_disk_size * 1024 * 1024
+            files = sorted(
+                (file for file in path.parent.iterdir() if file.suffix != ".tmp"),
+                key=lambda file: file.stat().st_mtime,
+            )
+            total = sum(file.stat().st_size for file in files)
+            for file in files:
+                if total <= max_size:
+                    break
+                total -= file.stat().st_size
+                file.unlink(missing_ok=True)
+        except OSError:
+            logger.exception("写入词云磁盘缓存失败")
+
+
+class MaskCache:
+    """解码后的 mask 数组缓存。
+
+    按文件路径缓存，文件的修改时间或大小变化后重新读取；
+    内存中按数组字节数进行 LRU 淘汰。渲染线程会同时访问，所以需要加锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple | None, Any]] = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        """缓存的数组总字节数。"""
+        return self._size
+
+    def get(self, path: Path, load: Callable[[Path], Any], *, name: str = "") -> Any:
+        """获取 mask 数组，不存在或文件已变化时读取并缓存。
+
+        Args:
+            path: mask 文件路径。
+            load: 读取 mask 文件并返回 numpy 数组的函数。
+            name: 同一文件生成的不同数组的名称。
+
+        Returns:
+            只读的 mask 数组。
+        """
+        key = f"{path}#{name}" if name else str(path)
+        signature = get_file_signature(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        array = load(path)
+        # 缓存的数组会被多次渲染共用，不允许修改
+        array.setflags(write=False)
+
+        max_size = plugin_config.wordcloud_mask_cache_size * 1024 * 1024
+        with self._lock:
+            self._pop(key)
+            if max_size and array.nbytes <= max_size:
+                self._entries[key] = (signature, array)
+                self._size += array.nbytes
+                while self._size > max_size:
+                    self._pop(next(iter(self._entries)))
+        return array
+
+    def clear(self) -> None:
+        """清空缓存。"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key: str) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= entry[1].nbytes
+
+
+class TokenCache:
+    """消息分词结果的内存缓存。
+
+    key 由消息内容和分析器配置计算，内存中按估算的字节数进行 LRU 淘汰。
+    分词在工作线程中进行，所以需要加锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple[str, ...], int]] = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        """缓存的估算总字节数。"""
+        return self._size
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, tuple[str, ...]]:
+        """批量获取缓存的分词结果。
+
+        Args:
+            keys: 消息的缓存 key。
+
+        Returns:
+            命中的 key 及其分词结果。
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if entry := self._entries.get(key):
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+        return found
+
+    def set_many(self, items: dict[str, tuple[str, ...]]) -> None:
+        """批量保存分词结果。
+
+        Args:
+            items: 消息的缓存 key 及其分词结果。
+        """
+        max_size = plugin_config.wordcloud_token_cache_size * 1024 * 1024
+        if not max_size:
+            return
+        with self._lock:
+            for key, tokens in items.items():
+                self._pop(key)
+                size = (
+                    sys.getsizeof(key)
+                    + sys.getsizeof(tokens)
+                    + sum(map(sys.getsizeof, tokens))
+                )
+                self._entries[key] = (tokens, size)
+                self._size += size
+            while self._size > max_size:
+                self._pop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """清空缓存。"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key: str) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= entry[1]
+
+
+wordcloud_cache = WordcloudCache()
+mask_cache = MaskCache()
+token_cache = TokenCache()
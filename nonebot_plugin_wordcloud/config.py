@@ -1,16 +1,25 @@
+import re
 from datetime import datetime, time
 from pathlib import Path
 from typing import Any, Literal
 from zoneinfo import ZoneInfo
 
 from nonebot import get_driver, get_plugin_config
-from nonebot.compat import model_validator
+from nonebot.compat import field_validator, model_validator
 from nonebot_plugin_localstore import get_data_dir
 from pydantic import BaseModel, Field
 
 from .model import ScheduleMode
 
 DATA_DIR = get_data_dir("nonebot_plugin_wordcloud")
+RenderPreset = Literal["fast", "balanced", "quality"]
+ImageFormat = Literal["png", "webp", "jpeg"]
+IMAGE_FORMATS: dict[str, tuple[str, str]] = {
+    "png": ("png", "image/png"),
+    "webp": ("webp", "image/webp"),
+    "jpeg": ("jpg", "image/jpeg"),
+}
+"""各图片格式对应的文件扩展名与 MIME 类型"""
 DEFAULT_SCHEDULE_TIME_BY_MODE = {
     ScheduleMode.COMPLETE: time(0, 0, 0),
     ScheduleMode.PERIOD_END: time(23, 59, 59),
@@ -68,12 +77,68 @@ class Config(BaseModel):
     wordcloud_background_color: str = "black"
     wordcloud_colormap: str | list[str] = "viridis"
     wordcloud_font_path: str
+    wordcloud_image_format: ImageFormat = "png"
+    """词云图片的编码格式"""
+    wordcloud_image_save_options: dict[str, Any] = {}
+    """保存图片时传递给 Pillow 的额外参数，如 compress_level、quality、lossless"""
     wordcloud_analyzer: Literal["jieba", "rjieba"] = "jieba"
     """词云文本分析后端"""
     wordcloud_analyzer_options: dict[str, Any] = {}
     """传递给词云文本分析后端的额外参数"""
     wordcloud_min_word_length: int = 2
-    """非 jieba 后端统计词频时保留的最小词长"""
+    """统计词频时保留的最小词长"""
+    wordcloud_exclude_words: list[str] = []
+    """需要排除的词语，使用正则表达式完整匹配"""
+    wordcloud_exclude_numeric_words: bool = False
+    """是否排除只由数字组成的词语"""
+    wordcloud_repeat_limit: int = 0
+    """一次生成词云的所有消息中相同的消息（复读）最多计入的次数，为 0 时不限制"""
+    wordcloud_analyzer_workers: int = 0
+    """并行分词使用的子进程数量，为 0 时在工作线程中分词"""
+    wordcloud_analyzer_parallel_threshold: int = 50000
+    """一次生成读取的消息超过多少条后，之后的消息在子进程中并行分词"""
+    wordcloud_message_batch_size: int = 1000
+    """分批读取聊天记录时每批的消息数量"""
+    wordcloud_rollup_days: int = 0
+    """按天汇总词频保留的天数，为 0 或限制复读消息计入次数时不汇总"""
+    wordcloud_warmup: bool = True
+    """是否在启动时于后台预热文本分析后端和图片生成依赖"""
+    wordcloud_render_backend: Literal["thread", "process"] = "thread"
+    """渲染词云图片使用的工作池类型"""
+    wordcloud_render_preset: RenderPreset = "quality"
+    """默认的渲染预设，速度更快的预设在更小的画布上布局后放大"""
+    wordcloud_render_preset_scenes: dict[str, RenderPreset] = {}
+    """按会话 mask key 单独设置的渲染预设"""
+    wordcloud_large_range_days: int = 90
+    """时间范围超过多少天时使用 wordcloud_large_range_preset，为 0 时不切换"""
+    wordcloud_large_range_preset: RenderPreset = "balanced"
+    """时间范围较大时使用的渲染预设"""
+    wordcloud_render_workers: int = 4
+    """同时渲染词云图片的最大数量"""
+    wordcloud_render_timeout: float | None = 60
+    """单次渲染的超时秒数，超时后使用简化参数重新生成，为空时不限制"""
+    wordcloud_render_queue_notice: int = 3
+    """排队位置达到多少时提示用户正在排队，为 0 时不提示"""
+    wordcloud_render_max_tasks: int = 100
+    """渲染工作池执行多少个任务后回收重建，为 0 时不按任务数回收"""
+    wordcloud_render_max_rss: int | None = None
+    """进程常驻内存超过多少 MB 时回收渲染工作池，为空时不按内存回收"""
+    wordcloud_mask_cache_size: int = 64
+    """解码后的 mask 图片缓存上限（MB），为 0 时不缓存"""
+    wordcloud_font_cache_size: int = 128
+    """所有渲染线程共用的字体对象缓存数量，已满时保留较小的字号，为 0 时不缓存"""
+    wordcloud_token_cache_size: int = 32
+    """内存中缓存消息分词结果的最大容量（MB），为 0 时不缓存"""
+    wordcloud_token_cache_persist: bool = False
+    """是否将消息分词结果保存到数据库"""
+    wordcloud_token_cache_days: int = 30
+    """数据库中的分词结果保存天数"""
+    wordcloud_cache_size: int = 64
+    """内存中缓存词云图片的最大容量（MB），为 0 时不使用内存缓存"""
+    wordcloud_cache_ttl: int = 60
+    """尚未结束的时间段（如今日）的词云缓存秒数，为 0 时不缓存"""
+    wordcloud_cache_disk_size: int = 0
+    """磁盘中缓存已结束时间段词云图片的最大容量（MB），为 0 时不使用磁盘缓存"""
     wordcloud_stopwords_path: Path | None = None
     wordcloud_userdict_path: Path | None = None
     wordcloud_timezone: str | None = None
@@ -136,6 +201,23 @@ class Config(BaseModel):
         values["wordcloud_default_schedule_time"] = default_schedule_time
         return values
 
+    @field_validator("wordcloud_exclude_words")
+    def check_exclude_words(cls, value: list[str]) -> list[str]:
+        """检查排除词语的正则表达式，配置有误时在启动时报错，而不是每次分析时。
+
+        Args:
+            value: 排除词语的正则表达式列表。
+
+        Returns:
+            原样返回的正则表达式列表。
+        """
+        for pattern in value:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"无效的正则表达式 {pattern!r}: {e}") from e
+        return value
+
     def get_default_schedule_time(
         self, schedule_mode: ScheduleMode | None = None
     ) -> time:
@@ -157,7 +239,9 @@ class Config(BaseModel):
         )
 
     def get_mask_path(self, key: str | None = None) -> Path:
-        """获取 mask 文件路径。
+        """获取按会话保存的 mask 文件路径。
+
+        新上传的 mask 按内容保存，这里的路径只用于兼容旧版本保存的文件。
 
         Args:
             key: 会话 mask key；为空时返回全局默认 mask 路径。
@@ -169,6 +253,32 @@ class Config(BaseModel):
             return DATA_DIR / "mask.png"
         return DATA_DIR / f"mask-{key}.png"
 
+    def get_mask_store_path(self, digest: str) -> Path:
+        """获取按内容保存的 mask 文件路径。
+
+        Args:
+            digest: mask 图片内容的摘要。
+
+        Returns:
+            mask 图片的存储路径。
+        """
+        return DATA_DIR / "masks" / f"{digest}.png"
+
+    def get_mask_index_path(self) -> Path:
+        """获取记录各会话所用 mask 的索引文件路径。"""
+        return DATA_DIR / "masks.json"
+
+    def get_cache_path(self, key: str) -> Path:
+        """获取词云图片磁盘缓存的文件路径。
+
+        Args:
+            key: 缓存 key。
+
+        Returns:
+            缓存文件的存储路径。
+        """
+        return DATA_DIR / "cache" / key
+
 
 global_config = get_driver().config
 plugin_config = get_plugin_config(Config)
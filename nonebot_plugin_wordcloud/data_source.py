@@ -1,83 +1,420 @@
 import asyncio
-import concurrent.futures
 import contextlib
-import re
+import hashlib
+import heapq
+import itertools
+import json
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Mapping,
+    Sequence,
+)
+from datetime import datetime, timedelta, timezone
 from functools import partial
 from io import BytesIO
+from pathlib import Path
 from random import choice
+from typing import TYPE_CHECKING, Any, TypeVar
 
-import numpy as np
-from emoji import replace_emoji
-from PIL import Image
-from wordcloud import WordCloud
+from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler
+from nonebot_plugin_chatrecorder import MessageRecord
+from nonebot_plugin_chatrecorder.record import filter_statement
+from nonebot_plugin_orm import get_session
+from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
+from sqlalchemy import Row, Select, delete, select
 
-from .analyzer import analyse_message
-from .config import global_config, plugin_config
+from .analyzer import (
+    WordAnalyzer,
+    analyzer_pool,
+    analyzer_registry,
+    get_word_analyzer,
+    warm_up_analyzer,
+)
+from .cache import (
+    FallbackImage,
+    get_cache_key,
+    get_file_signature,
+    mask_cache,
+    token_cache,
+)
+from .config import ImageFormat, RenderPreset, plugin_config
+from .model import MessageTokens
+from .preprocess import get_command_start, pre_precess
+from .render import RenderPriority, render_limiter, render_pool
+from .utils import get_plugin_version
 
+if TYPE_CHECKING:
+    import PIL.Image
+    from sqlalchemy import Insert
 
-def pre_precess(msg: str) -> str:
-    """对消息文本进行预处理。
+K = TypeVar("K")
+
+CLOSED_PERIOD_DELAY = timedelta(minutes=1)
+"""结束时间早于当前时间多久的时间段视为已结束，用于等待仍在写入的消息"""
+FALLBACK_MAX_WORDS = 50
+"""渲染超时后降级生成时最多使用的词语数量"""
+RENDER_PRESET_SCALES: dict[str, int] = {"fast": 4, "balanced": 2, "quality": 1}
+"""各渲染预设布局时画布缩小的倍数"""
+TOKEN_QUERY_CHUNK_SIZE = 500
+"""从数据库读取分词结果时每次查询的消息数量，避免超出 SQLite 的参数数量限制"""
+TOKEN_PURGE_JOB_ID = "wordcloud_token_purge"
+
+_background_tasks: set[asyncio.Task] = set()
+_render_context = threading.local()
+"""当前线程中插件渲染的状态，替换到 wordcloud 模块中的实现据此启用缓存"""
+_hooks_lock = threading.Lock()
+
+
+class MaskStore:
+    """按内容保存的 mask 图片。
+
+    相同内容的图片只保存一份，索引文件记录每个会话使用的图片，
+    没有会话再使用时删除图片。旧版本按会话保存的图片仍然可以读取，
+    重新设置或删除时一并清理。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: dict[str, str] = {}
+        self._index_signature: tuple | None = None
+
+    def get_path(self, key: str | None = None) -> Path | None:
+        """获取会话使用的 mask 文件路径。
+
+        Args:
+            key: 会话 mask key；为空时获取全局默认 mask。
+
+        Returns:
+            存在的 mask 文件路径；没有设置时返回 None。
+        """
+        with self._lock:
+            digest = self._load_index().get(key or "")
+        if digest:
+            path = plugin_config.get_mask_store_path(digest)
+            if path.exists():
+                return path
+        legacy_path = plugin_config.get_mask_path(key)
+        if legacy_path.exists():
+            return legacy_path
+
+    def save(self, image: bytes, key: str | None = None) -> Path:
+        """保存会话使用的 mask 图片。
+
+        Args:
+            image: 图片字节。
+            key: 会话 mask key；为空时设置全局默认 mask。
+
+        Returns:
+            mask 文件路径。
+        """
+        from PIL import Image
+
+        with self._lock, Image.open(BytesIO(image)) as mask:
+            # 按像素计算摘要，同一张图片被重新编码后也能识别
+            digest = hashlib.sha256(
+                f"{mask.mode}{mask.size}".encode() + mask.tobytes()
+            ).hexdigest()
+            path = plugin_config.get_mask_store_path(digest)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = path.with_suffix(".tmp")
+                mask.save(temp_path, format="PNG")
+                temp_path.replace(path)
+
+            index = self._load_index()
+            old_digest = index.get(key or "")
+            index[key or ""] = digest
+            self._save_index(index)
+            if old_digest and old_digest != digest:
+                self._release(index, old_digest)
+        remove_mask_files(plugin_config.get_mask_path(key))
+        return path
+
+    def remove(self, key: str | None = None) -> None:
+        """删除会话使用的 mask 图片。
+
+        Args:
+            key: 会话 mask key；为空时删除全局默认 mask。
+        """
+        with self._lock:
+            index = self._load_index()
+            if digest := index.pop(key or "", None):
+                self._save_index(index)
+                self._release(index, digest)
+        remove_mask_files(plugin_config.get_mask_path(key))
+
+    def get_refcount(self, digest: str) -> int:
+        """获取使用指定图片的会话数量。
+
+        Args:
+            digest: mask 图片内容的摘要。
+
+        Returns:
+            会话数量。
+        """
+        with self._lock:
+            return list(self._load_index().values()).count(digest)
+
+    def _load_index(self) -> dict[str, str]:
+        """读取索引，文件没有变化时使用内存中的副本。"""
+        path = plugin_config.get_mask_index_path()
+        signature = get_file_signature(path)
+        if signature != self._index_signature:
+            try:
+                self._index = json.loads(path.read_text(encoding="utf8"))
+            except FileNotFoundError:
+                self._index = {}
+            except (OSError, ValueError):
+                logger.exception("读取词云 mask 索引失败")
+                self._index = {}
+            self._index_signature = signature
+        return dict(self._index)
+
+    def _save_index(self, index: dict[str, str]) -> None:
+        path = plugin_config.get_mask_index_path()
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_text(
+            json.dumps(index, ensure_ascii=False, indent=2, sort_keys=True),
+            encoding="utf8",
+        )
+        temp_path.replace(path)
+        self._index = dict(index)
+        self._index_signature = get_file_signature(path)
+
+    def _release(self, index: dict[str, str], digest: str) -> None:
+        """没有会话使用时删除图片。"""
+        if digest not in index.values():
+            remove_mask_files(plugin_config.get_mask_store_path(digest))
+
+
+mask_store = MaskStore()
+
+
+def get_mask_path(key: str) -> Path | None:
+    """获取指定会话或默认的词云 mask 文件路径。
 
     Args:
-        msg: 原始消息文本。
+        key: 会话 mask key。
 
     Returns:
-        去除 URL、零宽字符和 emoji 后的消息文本。
+        存在的 mask 文件路径；没有可用 mask 时返回 None。
     """
-    # 去除网址
-    # https://stackoverflow.com/a/17773849/9212748
-    url_regex = re.compile(
-        r"(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]"
-        r"+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})"
-    )
-    msg = url_regex.sub("", msg)
+    # 如果会话没有设置 mask，则尝试默认 mask
+    return mask_store.get_path(key) or mask_store.get_path()
+
+
+def get_baked_mask_path(path: Path, width: int, height: int) -> Path:
+    """获取 mask 预处理结果的保存路径，与原图保存在同一目录。
 
-    # 去除 \u200b
-    msg = re.sub(r"\u200b", "", msg)
+    Args:
+        path: mask 图片路径。
+        width: 画布宽度。
+        height: 画布高度。
 
-    # 去除 emoji
-    # https://github.com/carpedm20/emoji
-    msg = replace_emoji(msg)
+    Returns:
+        预处理结果的 ``.npy`` 文件路径。
+    """
+    return path.with_name(f"{path.name}.{width}x{height}.npy")
 
-    return msg
 
+def bake_mask(image: "PIL.Image.Image", width: int, height: int):
+    """将 mask 图片转换为不超过画布大小的二值数组。
 
-def get_mask(key: str):
-    """读取指定会话或默认的词云 mask。
+    与 WordCloud 的判断方式一致，纯白色的像素不绘制词语，对应 255，
+    其余像素对应 0。图片只会缩小，并保持原有比例。
 
     Args:
-        key: 会话 mask key。
+        image: mask 图片。
+        width: 画布宽度。
+        height: 画布高度。
 
     Returns:
-        mask 图片对应的 numpy 数组；没有可用 mask 时返回 None。
+        二维的 uint8 数组。
     """
-    mask_path = plugin_config.get_mask_path(key)
-    if mask_path.exists():
-        return np.array(Image.open(mask_path))
-    # 如果指定 mask 文件不存在，则尝试默认 mask
-    default_mask_path = plugin_config.get_mask_path()
-    if default_mask_path.exists():
-        return np.array(Image.open(default_mask_path))
+    import numpy as np
+    from PIL import Image
+
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGBA")
+    array = np.asarray(image)
+    if array.ndim == 3:
+        masked = np.all(array[:, :, :3] == 255, axis=-1)
+    else:
+        masked = array == 255
+    binary = Image.fromarray(masked.astype(np.uint8) * 255)
+    ratio = min(width / binary.width, height / binary.height)
+    if ratio < 1:
+        size = (
+            max(round(binary.width * ratio), 1),
+            max(round(binary.height * ratio), 1),
+        )
+        binary = binary.resize(size, Image.Resampling.BILINEAR)
+    return np.where(np.asarray(binary) >= 128, 255, 0).astype(np.uint8)
 
 
-def _get_wordcloud(messages: list[str], mask_key: str) -> bytes | None:
-    """在线程池中同步生成词云图片。
+def _read_mask(path: Path, width: int, height: int):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return bake_mask(image, width, height)
+
+
+def save_baked_mask(path: Path, width: int, height: int):
+    """预处理 mask 图片并保存结果。
+
+    Args:
+        path: mask 图片路径。
+        width: 画布宽度。
+        height: 画布高度。
+
+    Returns:
+        预处理后的 mask 数组。
+    """
+    import numpy as np
+
+    array = _read_mask(path, width, height)
+    baked_path = get_baked_mask_path(path, width, height)
+    # 多个渲染任务可能同时处理同一张图片，先写入临时文件再替换
+    with tempfile.NamedTemporaryFile(
+        dir=baked_path.parent, suffix=".tmp", delete=False
+    ) as f:
+        np.save(f, array)
+    Path(f.name).replace(baked_path)
+    return array
+
+
+def _read_baked_mask(path: Path):
+    import numpy as np
+
+    return np.load(path, mmap_mode="r")
+
+
+def _shrink_mask(array, scale: float):
+    import numpy as np
+    from PIL import Image
+
+    height, width = array.shape
+    size = (max(round(width / scale), 1), max(round(height / scale), 1))
+    binary = Image.fromarray(np.asarray(array)).resize(size, Image.Resampling.BILINEAR)
+    return np.where(np.asarray(binary) >= 128, 255, 0).astype(np.uint8)
+
+
+def load_mask(path: Path, width: int, height: int, scale: float = 1):
+    """读取预处理后的词云 mask。
+
+    预处理结果不存在或比原图旧时重新生成。读取的数组会被缓存，
+    文件变化后自动重新读取。
+
+    WordCloud 使用 mask 时画布大小由 mask 决定，在缩小的画布上布局时，
+    mask 先按放大后的画布预处理再缩小，最终图片的大小与布局的倍数无关。
+
+    Args:
+        path: mask 图片路径。
+        width: 画布宽度。
+        height: 画布高度。
+        scale: 布局画布缩小的倍数，见 `get_layout_scale`。
+
+    Returns:
+        不超过画布大小的只读二值 mask 数组。
+    """
+    if scale > 1:
+        full_width, full_height = round(width * scale), round(height * scale)
+        full = load_mask(path, full_width, full_height)
+        return mask_cache.get(
+            get_baked_mask_path(path, full_width, full_height),
+            lambda _: _shrink_mask(full, scale),
+            name=f"scale-{scale:g}",
+        )
+
+    baked_path = get_baked_mask_path(path, width, height)
+    try:
+        fresh = baked_path.stat().st_mtime_ns >= path.stat().st_mtime_ns
+    except OSError:
+        fresh = False
+    if not fresh:
+        try:
+            save_baked_mask(path, width, height)
+        except OSError:
+            logger.warning(f"无法保存 mask 预处理结果：{baked_path}")
+            return mask_cache.get(path, partial(_read_mask, width=width, height=height))
+    return mask_cache.get(baked_path, _read_baked_mask)
+
+
+def save_mask(image: bytes, key: str | None = None) -> None:
+    """保存用户上传的 mask 图片，并按当前画布大小预处理。
+
+    Args:
+        image: 图片字节。
+        key: 会话 mask key；为空时设置全局默认 mask。
+    """
+    path = mask_store.save(image, key)
+    options = get_wordcloud_options()
+    try:
+        save_baked_mask(path, options["width"], options["height"])
+    except OSError:
+        logger.warning(f"无法保存 mask 预处理结果：{path}")
+
+
+def remove_mask(key: str | None = None) -> None:
+    """删除会话使用的 mask 图片。
+
+    Args:
+        key: 会话 mask key；为空时删除全局默认 mask。
+    """
+    mask_store.remove(key)
+
+
+def remove_mask_files(path: Path) -> None:
+    """删除 mask 图片及其预处理结果。
+
+    Args:
+        path: mask 图片路径。
+    """
+    path.unlink(missing_ok=True)
+    for baked_path in path.parent.glob(f"{path.name}.*.npy"):
+        baked_path.unlink(missing_ok=True)
+
+
+def get_render_preset(mask_key: str, start: datetime, stop: datetime) -> RenderPreset:
+    """获取生成词云使用的渲染预设。
+
+    优先使用会话单独设置的预设，其次根据时间范围大小选择。
 
     Args:
-        messages: 用于生成词云的消息文本列表。
         mask_key: 当前会话对应的 mask key。
+        start: 查询开始时间。
+        stop: 查询结束时间。
+
+    Returns:
+        渲染预设名称。
+    """
+    if preset := plugin_config.wordcloud_render_preset_scenes.get(mask_key):
+        return preset
+    large_range_days = plugin_config.wordcloud_large_range_days
+    if large_range_days and stop - start > timedelta(days=large_range_days):
+        return plugin_config.wordcloud_large_range_preset
+    return plugin_config.wordcloud_render_preset
+
+
+def get_wordcloud_options(preset: RenderPreset = "quality") -> dict[str, Any]:
+    """根据插件配置生成传递给 WordCloud 的参数。
+
+    速度更快的预设会在缩小后的画布上布局，再通过 ``scale`` 放大到原尺寸。
+
+    Args:
+        preset: 渲染预设名称。
 
     Returns:
-        PNG 图片字节；数据不足或生成失败时返回 None。
+        WordCloud 参数字典，不包含 mask。
     """
-    # 过滤掉命令
-    command_start = tuple(i for i in global_config.command_start if i)
-    message = " ".join(m for m in messages if not m.startswith(command_start))
-    # 预处理
-    message = pre_precess(message)
-    # 分析消息。分词，并统计词频
-    frequency = analyse_message(message)
-    # 词云参数
     wordcloud_options = {}
     wordcloud_options.update(plugin_config.wordcloud_options)
     wordcloud_options.setdefault("font_path", str(plugin_config.wordcloud_font_path))
@@ -93,28 +430,933 @@ def _get_wordcloud(messages: list[str], mask_key: str) -> bytes | None:
         else choice(plugin_config.wordcloud_colormap)
     )
     wordcloud_options.setdefault("colormap", colormap)
-    wordcloud_options.setdefault("mask", get_mask(mask_key))
-    with contextlib.suppress(ValueError):
-        wordcloud = WordCloud(**wordcloud_options)
-        image = wordcloud.generate_from_frequencies(frequency).to_image()
-        image_bytes = BytesIO()
-        image.save(image_bytes, format="PNG")
-        return image_bytes.getvalue()
+    if (factor := RENDER_PRESET_SCALES[preset]) > 1:
+        wordcloud_options["width"] = max(wordcloud_options["width"] // factor, 1)
+        wordcloud_options["height"] = max(wordcloud_options["height"] // factor, 1)
+        wordcloud_options["scale"] = wordcloud_options.get("scale", 1) * factor
+    return wordcloud_options
+
+
+def get_layout_scale(options: dict[str, Any]) -> float:
+    """获取布局画布相对配置的画布缩小的倍数，由渲染预设与降级生成决定。
+
+    Args:
+        options: 传递给 WordCloud 的参数。
+
+    Returns:
+        缩小的倍数，不缩小时为 1。
+    """
+    return options.get("scale", 1) / plugin_config.wordcloud_options.get("scale", 1)
+
+
+def get_fallback_options(options: dict[str, Any]) -> dict[str, Any]:
+    """获取渲染超时后降级生成使用的参数。
+
+    减少词语数量，并在一半大小的画布上布局后放大到原尺寸。
+
+    Args:
+        options: 原本传递给 WordCloud 的参数。
+
+    Returns:
+        降级后的 WordCloud 参数。
+    """
+    options = dict(options)
+    options["max_words"] = min(options.get("max_words", 200), FALLBACK_MAX_WORDS)
+    options["width"] = max(options["width"] // 2, 1)
+    options["height"] = max(options["height"] // 2, 1)
+    options["scale"] = options.get("scale", 1) * 2
+    return options
+
+
+def get_wordcloud_cache_key(
+    mask_key: str,
+    start: datetime,
+    stop: datetime,
+    user_ids: Iterable[str] | None = None,
+) -> tuple[str, float | None]:
+    """获取词云图片的缓存 key 与缓存有效期。
+
+    已经结束一段时间的时间段不会再有新消息，缓存永不过期；尚未结束的时间段
+    （如今日）忽略结束时间，并只缓存 ``wordcloud_cache_ttl`` 秒。
+
+    Args:
+        mask_key: 当前会话对应的 mask key，同时用于区分会话。
+        start: 查询开始时间。
+        stop: 查询结束时间。
+        user_ids: 只统计这些用户的消息；为空时统计所有用户。
+
+    Returns:
+        缓存 key 与缓存有效秒数，有效秒数为 None 时永不过期。
+    """
+    # 没有时区信息的时间视为本地时间
+    closed = stop.astimezone() <= datetime.now().astimezone() - CLOSED_PERIOD_DELAY
+    key = get_cache_key(
+        mask_key,
+        start.astimezone(timezone.utc).isoformat(),
+        stop.astimezone(timezone.utc).isoformat() if closed else None,
+        sorted(user_ids) if user_ids else None,
+        sorted(plugin_config.wordcloud_exclude_user_ids),
+        get_token_fingerprint(),
+        plugin_config.wordcloud_repeat_limit,
+        plugin_config.wordcloud_options,
+        plugin_config.wordcloud_width,
+        plugin_config.wordcloud_height,
+        plugin_config.wordcloud_background_color,
+        plugin_config.wordcloud_colormap,
+        plugin_config.wordcloud_font_path,
+        plugin_config.wordcloud_image_format,
+        plugin_config.wordcloud_image_save_options,
+        get_render_preset(mask_key, start, stop),
+        get_file_signature(get_mask_path(mask_key)),
+    )
+    return key, None if closed else plugin_config.wordcloud_cache_ttl
+
+
+async def paginate_messages(statement: Select) -> AsyncIterator[Sequence[Row]]:
+    """按消息 id 分页执行查询。
+
+    每批使用单独的数据库会话，内存占用不随时间范围增大。
+
+    Args:
+        statement: 消息记录的查询语句，第一列必须是 ``MessageRecord.id``。
+
+    Yields:
+        每批查询结果，批次大小为 ``wordcloud_message_batch_size``。
+    """
+    statement = statement.order_by(MessageRecord.id).limit(
+        plugin_config.wordcloud_message_batch_size
+    )
+    last_id = None
+    while True:
+        batch_statement = statement
+        if last_id is not None:
+            batch_statement = statement.where(MessageRecord.id > last_id)
+        async with get_session() as db_session:
+            rows = (await db_session.execute(batch_statement)).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+async def iter_messages_plain_text(**kwargs) -> AsyncIterator[Sequence[str]]:
+    """分批读取消息记录的纯文本。
+
+    与 ``get_messages_plain_text`` 的筛选条件相同，但按消息 id 分页查询，
+    每批使用单独的数据库会话，内存占用不随时间范围增大。
 
+    Args:
+        **kwargs: 筛选参数，具体查看 chatrecorder 的 ``filter_statement``。
+
+    Yields:
+        每批消息的纯文本，批次大小为 ``wordcloud_message_batch_size``。
+    """
+    whereclause = filter_statement(**kwargs)
+    statement = (
+        select(MessageRecord.id, MessageRecord.plain_text)
+        .where(*whereclause)
+        .join(SessionModel, SessionModel.id == MessageRecord.session_persist_id)
+        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
+        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
+        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    )
+    async for rows in paginate_messages(statement):
+        yield [row[1] for row in rows]
+
+
+def preprocess_messages(messages: Iterable[str]) -> Iterator[str]:
+    """过滤命令并逐条预处理消息。
+
+    Args:
+        messages: 消息文本。
+
+    Yields:
+        预处理后不为空的消息文本。
+    """
+    command_start = get_command_start()
+    for message in messages:
+        # 过滤掉命令
+        if message.startswith(command_start):
+            continue
+        if message := pre_precess(message).strip():
+            yield message
+
+
+def collapse_messages(messages: Iterable[str]) -> Counter[str]:
+    """合并相同的消息，每条不同的消息只需分词一次。
+
+    复读的消息按 ``wordcloud_repeat_limit`` 限制计入的次数。
+
+    Args:
+        messages: 预处理后的消息文本。
+
+    Returns:
+        每条不同的消息及其计入的次数。
+    """
+    repeats = Counter(messages)
+    if limit := plugin_config.wordcloud_repeat_limit:
+        for message, repeat in repeats.items():
+            if repeat > limit:
+                repeats[message] = limit
+    return repeats
+
+
+def count_messages(analyzer: WordAnalyzer, messages: Iterable[str]) -> Counter[str]:
+    """过滤命令并预处理一批消息，合并相同的消息后逐条分词并统计词语次数。
+
+    Args:
+        analyzer: 文本分析后端。
+        messages: 一批消息文本。
+
+    Returns:
+        词语及其出现次数。
+    """
+    counts: Counter[str] = Counter()
+    for message, repeat in collapse_messages(preprocess_messages(messages)).items():
+        for word in analyzer.cut(message):
+            counts[word] += repeat
+    return counts
+
+
+def cut_messages(
+    analyzer: WordAnalyzer, messages: Iterable[str]
+) -> list[tuple[str, ...]]:
+    """逐条分词，消息需要已经过滤命令并预处理。
+
+    Args:
+        analyzer: 文本分析后端。
+        messages: 预处理后的消息文本。
+
+    Returns:
+        每条消息的分词结果，顺序与消息一致。
+    """
+    return [tuple(analyzer.cut(message)) for message in messages]
+
+
+def _count_messages_in_worker(messages: Sequence[str]) -> Counter[str]:
+    return count_messages(get_word_analyzer(), messages)
+
+
+def _cut_messages_in_worker(messages: Sequence[str]) -> list[tuple[str, ...]]:
+    return cut_messages(get_word_analyzer(), messages)
+
+
+def analyse_messages(messages: Iterable[str]) -> dict[str, float]:
+    """过滤命令并预处理消息，然后统计词语权重。
+
+    Args:
+        messages: 用于生成词云的消息文本。
 
-async def get_wordcloud(messages: list[str], mask_key: str) -> bytes | None:
+    Returns:
+        词语及其权重。
+    """
+    # 分析消息。逐条分词，并合并词频
+    analyzer = get_word_analyzer()
+    return analyzer.weigh(count_messages(analyzer, messages))
+
+
+def _insert_ignore(dialect: str) -> "Insert":
+    """生成忽略主键冲突的 `MessageTokens` 插入语句。
+
+    Args:
+        dialect: 数据库方言名称。
+
+    Returns:
+        插入语句，摘要已经存在的行会被跳过。
+    """
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert(MessageTokens).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+
+        return insert(MessageTokens).on_conflict_do_nothing()
+    from sqlalchemy.dialects.mysql import insert
+
+    return insert(MessageTokens).prefix_with("IGNORE")
+
+
+class TokenStore:
+    """保存在数据库中的消息分词结果。
+
+    按消息内容与分析器配置的摘要保存，重启后仍可使用。超过
+    ``wordcloud_token_cache_days`` 天的记录由定时任务每天删除，
+    见 `start_token_purge`。
+    """
+
+    async def get_many(self, digests: Iterable[str]) -> dict[str, tuple[str, ...]]:
+        """批量读取分词结果。
+
+        Args:
+            digests: 消息的摘要。
+
+        Returns:
+            数据库中存在的摘要及其分词结果。
+        """
+        digests = list(digests)
+        found = {}
+        async with get_session() as db_session:
+            for i in range(0, len(digests), TOKEN_QUERY_CHUNK_SIZE):
+                rows = await db_session.execute(
+                    select(MessageTokens.digest, MessageTokens.tokens).where(
+                        MessageTokens.digest.in_(
+                            digests[i : i + TOKEN_QUERY_CHUNK_SIZE]
+                        )
+                    )
+                )
+                found.update((digest, tuple(tokens)) for digest, tokens in rows)
+        return found
+
+    async def set_many(self, items: dict[str, tuple[str, ...]]) -> None:
+        """批量保存分词结果。
+
+        其他任务同时保存了相同的消息时跳过这些消息，其余的分词结果仍然保存。
+
+        Args:
+            items: 消息的摘要及其分词结果。
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with get_session() as db_session:
+            statement = _insert_ignore(db_session.get_bind(MessageTokens).dialect.name)
+            await db_session.execute(
+                statement,
+                [
+                    {"digest": digest, "tokens": list(tokens), "created_at": now}
+                    for digest, tokens in items.items()
+                ],
+            )
+            await db_session.commit()
+
+    async def purge(self) -> None:
+        """删除超过保存天数的分词结果。"""
+        expire_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+            days=plugin_config.wordcloud_token_cache_days
+        )
+        async with get_session() as db_session:
+            await db_session.execute(
+                delete(MessageTokens).where(MessageTokens.created_at < expire_at)
+            )
+            await db_session.commit()
+
+
+token_store = TokenStore()
+
+
+async def start_token_purge() -> None:
+    """根据配置添加每天删除过期分词结果的定时任务，并立即删除一次。"""
+    if not plugin_config.wordcloud_token_cache_persist:
+        return
+    scheduler.add_job(
+        token_store.purge,
+        "cron",
+        hour=0,
+        minute=20,
+        id=TOKEN_PURGE_JOB_ID,
+        replace_existing=True,
+    )
+    task = asyncio.create_task(token_store.purge())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def get_token_fingerprint() -> str:
+    """获取会影响分词结果的配置摘要，配置变化后不再使用旧的分词结果。
+
+    插件版本也包含在内，升级后预处理、分词等实现可能变化，不再使用旧的结果。
+
+    Returns:
+        插件版本、分析后端、词典文件状态、分析参数、词语筛选规则与命令前缀的摘要。
+    """
+    return get_cache_key(
+        get_plugin_version(),
+        analyzer_registry.get_key(),
+        plugin_config.wordcloud_analyzer_options,
+        plugin_config.wordcloud_min_word_length,
+        plugin_config.wordcloud_exclude_words,
+        plugin_config.wordcloud_exclude_numeric_words,
+        get_command_start(),
+    )
+
+
+def get_message_digest(fingerprint: str, message: str) -> str:
+    """获取消息分词结果的缓存 key。
+
+    Args:
+        fingerprint: `get_token_fingerprint` 的结果。
+        message: 预处理后的消息文本。
+
+    Returns:
+        32 位十六进制摘要。
+    """
+    data = f"{fingerprint}\n{message}".encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _lookup_tokens(
+    fingerprint: str, messages: Iterable[str]
+) -> tuple[Counter[str], dict[str, tuple[str, ...]], dict[str, str]]:
+    """预处理并合并相同的消息，然后查找内存中缓存的分词结果。
+
+    Returns:
+        每条不同消息的摘要及其计入的次数、命中的分词结果，以及未命中的摘要与消息。
+    """
+    repeats: Counter[str] = Counter()
+    pending: dict[str, str] = {}
+    for message, repeat in collapse_messages(preprocess_messages(messages)).items():
+        digest = get_message_digest(fingerprint, message)
+        repeats[digest] = repeat
+        pending[digest] = message
+    found = token_cache.get_many(pending)
+    for digest in found:
+        del pending[digest]
+    return repeats, found, pending
+
+
+def _limit_repeats(repeats: Counter[str], counted: Counter[str]) -> None:
+    """按整个查询限制复读的消息计入的次数。
+
+    超出 ``wordcloud_repeat_limit`` 的部分从 ``repeats`` 中去掉，计入的次数
+    累加到 ``counted`` 中。
+
+    Args:
+        repeats: 这批消息中每条不同消息的摘要及其计入的次数。
+        counted: 本次查询中之前的批次已经计入的次数。
+    """
+    limit = plugin_config.wordcloud_repeat_limit
+    for digest, repeat in list(repeats.items()):
+        if (repeat := min(repeat, limit - counted[digest])) > 0:
+            repeats[digest] = repeat
+            counted[digest] += repeat
+        else:
+            del repeats[digest]
+
+
+def _count_tokens(
+    repeats: Counter[str],
+    found: dict[str, tuple[str, ...]],
+    tokens: dict[str, tuple[str, ...]],
+) -> Counter[str]:
+    """缓存新分词的结果，然后统计所有消息的词语次数。
+
+    Returns:
+        词语及其出现次数。
+    """
+    token_cache.set_many(tokens)
+    found.update(tokens)
+    counts: Counter[str] = Counter()
+    for digest, repeat in repeats.items():
+        for word in found[digest]:
+            counts[word] += repeat
+    return counts
+
+
+async def count_messages_cached(
+    analyzer: WordAnalyzer,
+    fingerprint: str,
+    messages: Sequence[str],
+    *,
+    parallel: bool = False,
+    counted: Counter[str] | None = None,
+) -> Counter[str]:
+    """统计一批消息的词语次数，分过词的消息直接使用缓存的结果。
+
+    依次查找内存和数据库中的分词结果，只对剩下的消息分词，并写回缓存。
+
+    Args:
+        analyzer: 文本分析后端。
+        fingerprint: `get_token_fingerprint` 的结果。
+        messages: 一批消息文本。
+        parallel: 是否在分词工作池的子进程中分词。
+        counted: 本次查询中之前的批次已经计入的次数，用于按整个查询限制复读的
+            消息；为空时只在这批消息中限制。
+
+    Returns:
+        词语及其出现次数。
+    """
+    persist = plugin_config.wordcloud_token_cache_persist
+    if not plugin_config.wordcloud_token_cache_size and not persist and counted is None:
+        if parallel:
+            return await analyzer_pool.run(_count_messages_in_worker, list(messages))
+        return await asyncio.to_thread(count_messages, analyzer, messages)
+
+    repeats, found, pending = await asyncio.to_thread(
+        _lookup_tokens, fingerprint, messages
+    )
+    if counted is not None:
+        # 在事件循环中执行，同时处理的多批消息不会同时修改 counted
+        _limit_repeats(repeats, counted)
+        pending = {digest: pending[digest] for digest in repeats if digest in pending}
+    if persist and pending:
+        stored = await token_store.get_many(pending)
+        token_cache.set_many(stored)
+        found.update(stored)
+        for digest in stored:
+            del pending[digest]
+    pending_messages = list(pending.values())
+    if parallel and pending_messages:
+        results = await analyzer_pool.run(_cut_messages_in_worker, pending_messages)
+    else:
+        results = await asyncio.to_thread(cut_messages, analyzer, pending_messages)
+    tokens = dict(zip(pending, results))
+    counts = await asyncio.to_thread(_count_tokens, repeats, found, tokens)
+    if persist and tokens:
+        await token_store.set_many(tokens)
+    return counts
+
+
+class WordCounter:
+    """逐批统计消息中的词语次数，多个会话可以共用同一个实例。
+
+    开启分词工作池后，读取的消息一共超过 ``wordcloud_analyzer_parallel_threshold``
+    条时，之后的每批消息交给子进程分词，同时继续读取下一批，同时处理的批次
+    不超过子进程数量。
+    """
+
+    def __init__(self, analyzer: WordAnalyzer, fingerprint: str):
+        self.analyzer = analyzer
+        self.fingerprint = fingerprint
+        self.total = 0
+        """已经读取的消息数量"""
+        self._slots = asyncio.Semaphore(
+            max(plugin_config.wordcloud_analyzer_workers, 1)
+        )
+
+    async def count(
+        self, batches: AsyncIterable[Sequence[str] | Counter[str]]
+    ) -> Counter[str]:
+        """统计分批消息中的词语次数，每批处理完即可释放。
+
+        Args:
+            batches: 分批的消息文本，或已经统计好的词语次数。
+
+        Returns:
+            词语及其出现次数。
+        """
+        counts: Counter[str] = Counter()
+        # 复读的消息按整个查询限制计入的次数
+        counted: Counter[str] | None = (
+            Counter() if plugin_config.wordcloud_repeat_limit else None
+        )
+        tasks: set[asyncio.Task[Counter[str]]] = set()
+        try:
+            async for batch in batches:
+                if isinstance(batch, Counter):
+                    counts.update(batch)
+                    continue
+                self.total += len(batch)
+                if (
+                    not analyzer_pool.enabled
+                    or self.total <= plugin_config.wordcloud_analyzer_parallel_threshold
+                ):
+                    counts.update(
+                        await count_messages_cached(
+                            self.analyzer, self.fingerprint, batch, counted=counted
+                        )
+                    )
+                    continue
+                await self._slots.acquire()
+                tasks.add(asyncio.create_task(self._count_parallel(batch, counted)))
+                for task in [task for task in tasks if task.done()]:
+                    tasks.discard(task)
+                    counts.update(task.result())
+            for result in await asyncio.gather(*tasks):
+                counts.update(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return counts
+
+    async def _count_parallel(
+        self, batch: Sequence[str], counted: Counter[str] | None
+    ) -> Counter[str]:
+        try:
+            return await count_messages_cached(
+                self.analyzer, self.fingerprint, batch, parallel=True, counted=counted
+            )
+        finally:
+            self._slots.release()
+
+
+async def analyse_message_batches(
+    batches: AsyncIterable[Sequence[str] | Counter[str]],
+) -> dict[str, float]:
+    """逐批统计消息中的词语次数，全部读取完后再计算权重。
+
+    每批消息在工作线程或分词工作池中分析，处理完即可释放，只保留累计的词频。
+
+    Args:
+        batches: 分批的消息文本，如 `iter_messages_plain_text` 的结果；
+            也可以是已经统计好的词语次数，如按天汇总的词频。
+
+    Returns:
+        词语及其权重。
+    """
+    analyzer = await asyncio.to_thread(get_word_analyzer)
+    fingerprint = await asyncio.to_thread(get_token_fingerprint)
+    counts = await WordCounter(analyzer, fingerprint).count(batches)
+    return await asyncio.to_thread(analyzer.weigh, counts)
+
+
+async def analyse_many(
+    messages: Mapping[K, Sequence[str] | AsyncIterable[Sequence[str] | Counter[str]]],
+) -> dict[K, dict[str, float]]:
+    """一起分析多个会话的消息，如定时发送时需要生成词云的所有会话。
+
+    所有会话共用同一个分析器和分词缓存，读取的消息数量合并计算是否超过
+    并行分词的阈值，同时分析的会话数量不超过分词子进程数量。
+
+    Args:
+        messages: 会话及其消息文本，或分批的消息文本与词频。
+
+    Returns:
+        各会话的词语及其权重。
+    """
+    analyzer = await asyncio.to_thread(get_word_analyzer)
+    fingerprint = await asyncio.to_thread(get_token_fingerprint)
+    counter = WordCounter(analyzer, fingerprint)
+    limiter = asyncio.Semaphore(max(plugin_config.wordcloud_analyzer_workers, 1))
+
+    async def _analyse(
+        batches: Sequence[str] | AsyncIterable[Sequence[str] | Counter[str]],
+    ) -> dict[str, float]:
+        if not isinstance(batches, AsyncIterable):
+            batches = _iter_single_batch(batches)
+        async with limiter:
+            counts = await counter.count(batches)
+        return await asyncio.to_thread(analyzer.weigh, counts)
+
+    results = await asyncio.gather(*map(_analyse, messages.values()))
+    return dict(zip(messages, results))
+
+
+async def _iter_single_batch(messages: Sequence[str]) -> AsyncIterator[Sequence[str]]:
+    yield messages
+
+
+class CachedImageFont:
+    """代替 wordcloud 模块中的 ``PIL.ImageFont``，在插件渲染时复用字体对象。
+
+    WordCloud 布局时会为每个候选字号调用 ``ImageFont.truetype``，每次都要重新
+    解析字体文件。字体对象按 (路径, 字号) 缓存，所有渲染线程共用，数量上限为
+    ``wordcloud_font_cache_size``。FreeType 字体对象不是线程安全的，
+    每个字体对象都带有自己的锁，同一时间只能在一个线程中使用。
+
+    WordCloud 会从画布高度开始逐个字号向下尝试，一次渲染几乎用到所有字号，
+    按最近使用淘汰时缓存放不下所有字号就会全部失效。小字号在每次渲染中都会
+    被反复使用，因此缓存已满时淘汰字号最大的字体对象，比缓存中所有字号都大的
+    字体对象不再缓存。
+    """
+
+    def __init__(self, module: Any):
+        self._module = module
+        self._lock = threading.Lock()
+        self._fonts: dict[tuple[Any, Any], Any] = {}
+        # 按字号排列的最大堆，用于找到需要淘汰的字体对象
+        self._sizes: list[tuple[Any, int, tuple[Any, Any]]] = []
+        self._order = itertools.count()
+
+        class LockedFreeTypeFont(module.FreeTypeFont):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                # getmask 内部会调用 getmask2，需要可重入
+                self._lock = threading.RLock()
+
+            def getbbox(self, *args, **kwargs):
+                with self._lock:
+                    return super().getbbox(*args, **kwargs)
+
+            def getlength(self, *args, **kwargs):
+                with self._lock:
+                    return super().getlength(*args, **kwargs)
+
+            def getmask(self, *args, **kwargs):
+                with self._lock:
+                    return super().getmask(*args, **kwargs)
+
+            def getmask2(self, *args, **kwargs):
+                with self._lock:
+                    return super().getmask2(*args, **kwargs)
+
+            def getmetrics(self, *args, **kwargs):
+                with self._lock:
+                    return super().getmetrics(*args, **kwargs)
+
+        self._font_class = LockedFreeTypeFont
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._module, name)
+
+    def clear(self) -> None:
+        """清空缓存的字体对象。"""
+        with self._lock:
+            self._fonts.clear()
+            self._sizes.clear()
+
+    def truetype(self, font=None, size=10, *args, **kwargs):
+        cache_size = plugin_config.wordcloud_font_cache_size
+        if (
+            not getattr(_render_context, "active", False)
+            or cache_size <= 0
+            or args
+            or kwargs
+        ):
+            return self._module.truetype(font, size, *args, **kwargs)
+
+        key = (font, size)
+        with self._lock:
+            if (cached := self._fonts.get(key)) is not None:
+                return cached
+
+        loaded = self._font_class(font, size)
+        _render_context.font_loads += 1
+        with self._lock:
+            # 其他线程可能已经加载了相同的字体
+            if (cached := self._fonts.get(key)) is not None:
+                return cached
+            while len(self._fonts) >= cache_size:
+                largest, _, largest_key = self._sizes[0]
+                if -largest <= size:
+                    return loaded
+                heapq.heappop(self._sizes)
+                del self._fonts[largest_key]
+            self._fonts[key] = loaded
+            heapq.heappush(self._sizes, (-size, next(self._order), key))
+        return loaded
+
+
+def install_wordcloud_hooks() -> None:
+    """替换 wordcloud 模块中的部分实现，在插件渲染时复用不变的中间结果。
+
+    - ``IntegralOccupancyMap``：WordCloud 每次布局都会根据 mask 重新计算积分图，
+      mask 与画布大小不变时结果也不变，这里从 mask 缓存中复制一份初始积分图。
+    - ``ImageFont``：复用已经加载的字体对象，见 `CachedImageFont`。
+
+    只有在 `_get_wordcloud` 中渲染时才会使用缓存，其他情况保持原有行为。
+    """
+    import wordcloud.wordcloud as wordcloud_module
+
+    with _hooks_lock:
+        base = wordcloud_module.IntegralOccupancyMap
+        if getattr(base, "_cached", False):
+            return
+
+        class CachedIntegralOccupancyMap(base):
+            _cached = True
+
+            def __init__(self, height, width, mask):
+                key = getattr(_render_context, "occupancy_key", None)
+                if key is None or mask is None:
+                    super().__init__(height, width, mask)
+                    return
+                path, name = key
+                integral = mask_cache.get(
+                    path,
+                    lambda _: base(height, width, mask).integral,
+                    name=name,
+                )
+                self.height = height
+                self.width = width
+                # 布局时会更新积分图，不能直接修改缓存
+                self.integral = integral.copy()
+
+        wordcloud_module.IntegralOccupancyMap = CachedIntegralOccupancyMap
+        wordcloud_module.ImageFont = CachedImageFont(wordcloud_module.ImageFont)
+
+
+def encode_image(
+    image: "PIL.Image.Image",
+    image_format: ImageFormat = "png",
+    save_options: dict[str, Any] | None = None,
+) -> bytes:
+    """将图片编码为指定格式。
+
+    Args:
+        image: 需要编码的图片。
+        image_format: 图片格式。
+        save_options: 传递给 Pillow 的额外参数。
+
+    Returns:
+        编码后的图片字节。
+    """
+    # JPEG 不支持透明通道
+    if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image_bytes = BytesIO()
+    image.save(image_bytes, format=image_format.upper(), **(save_options or {}))
+    return image_bytes.getvalue()
+
+
+def _get_wordcloud(
+    frequency: dict[str, float],
+    options: dict[str, Any],
+    mask_path: Path | None,
+    image_format: ImageFormat = "png",
+    save_options: dict[str, Any] | None = None,
+) -> bytes | None:
+    """在渲染工作池中同步生成词云图片。
+
+    使用进程工作池时只有词频、参数和 mask 路径需要传递给子进程，
+    因此这里不能依赖主进程中修改过的插件配置。
+
+    Args:
+        frequency: 词语及其权重。
+        options: 传递给 WordCloud 的参数。
+        mask_path: mask 图片路径；为空时不使用 mask。
+        image_format: 图片格式。
+        save_options: 保存图片时传递给 Pillow 的额外参数。
+
+    Returns:
+        图片字节；数据不足或生成失败时返回 None。
+    """
+    from wordcloud import WordCloud
+
+    install_wordcloud_hooks()
+    options = dict(options)
+    if mask_path is not None:
+        options.setdefault(
+            "mask",
+            load_mask(
+                mask_path,
+                options["width"],
+                options["height"],
+                get_layout_scale(options),
+            ),
+        )
+        _render_context.occupancy_key = (
+            mask_path,
+            f"occupancy-{options['width']}x{options['height']}",
+        )
+    _render_context.active = True
+    _render_context.font_loads = 0
+    start = time.perf_counter()
+    try:
+        with contextlib.suppress(ValueError):
+            wordcloud = WordCloud(**options)
+            image = wordcloud.generate_from_frequencies(frequency).to_image()
+            return encode_image(image, image_format, save_options)
+    finally:
+        _render_context.active = False
+        _render_context.occupancy_key = None
+        logger.info(
+            f"生成词云耗时 {time.perf_counter() - start:.2f}s，"
+            f"加载字体 {_render_context.font_loads} 次"
+        )
+
+
+async def get_wordcloud(
+    messages: Sequence[str] | AsyncIterable[Sequence[str] | Counter[str]],
+    mask_key: str,
+    *,
+    priority: RenderPriority = RenderPriority.INTERACTIVE,
+    preset: RenderPreset = "quality",
+) -> bytes | None:
     """异步生成词云图片。
 
+    分词在工作线程中完成，图片在渲染工作池中生成。同时渲染的数量受限，
+    超出时按优先级排队，读取和分析消息不占用渲染名额。
+    渲染超时后会使用简化参数重新生成，返回 `FallbackImage`。
+
+    Args:
+        messages: 用于生成词云的消息文本列表，或分批的消息文本与词频。
+        mask_key: 当前会话对应的 mask key。
+        priority: 排队优先级。
+        preset: 渲染预设名称。
+
+    Returns:
+        图片字节；数据不足、生成失败或简化后仍然超时时返回 None。
+    """
+    if not isinstance(messages, AsyncIterable):
+        messages = _iter_single_batch(messages)
+    frequency = await analyse_message_batches(messages)
+    return await render_wordcloud(frequency, mask_key, priority=priority, preset=preset)
+
+
+async def render_wordcloud(
+    frequency: dict[str, float],
+    mask_key: str,
+    *,
+    priority: RenderPriority = RenderPriority.INTERACTIVE,
+    preset: RenderPreset = "quality",
+) -> bytes | None:
+    """使用已经分析好的词频生成词云图片，如 `analyse_many` 的结果。
+
     Args:
-        messages: 用于生成词云的消息文本列表。
+        frequency: 词语及其权重。
         mask_key: 当前会话对应的 mask key。
+        priority: 排队优先级。
+        preset: 渲染预设名称。
 
     Returns:
-        PNG 图片字节；数据不足或生成失败时返回 None。
+        图片字节；数据不足、生成失败或简化后仍然超时时返回 None。
     """
-    loop = asyncio.get_running_loop()
-    pfunc = partial(_get_wordcloud, messages, mask_key)
-    # 虽然不知道具体是哪里泄漏了，但是通过每次关闭线程池可以避免这个问题
-    # https://github.com/he0119/nonebot-plugin-wordcloud/issues/99
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, pfunc)
+    async with render_limiter.acquire(priority):
+        return await _render_wordcloud(frequency, mask_key, preset)
+
+
+async def _render_wordcloud(
+    frequency: dict[str, float], mask_key: str, preset: RenderPreset
+) -> bytes | None:
+    timeout = plugin_config.wordcloud_render_timeout or None
+    options = get_wordcloud_options(preset)
+    mask_path = get_mask_path(mask_key)
+    try:
+        return await render_pool.run(
+            _get_wordcloud,
+            frequency,
+            options,
+            mask_path,
+            plugin_config.wordcloud_image_format,
+            plugin_config.wordcloud_image_save_options,
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"生成词云超过 {timeout}s，使用简化参数重新生成")
+    # mask 会按降级后的画布大小重新缩放，词云形状保持不变
+    try:
+        image = await render_pool.run(
+            _get_wordcloud,
+            frequency,
+            get_fallback_options(options),
+            mask_path,
+            plugin_config.wordcloud_image_format,
+            plugin_config.wordcloud_image_save_options,
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        logger.error("使用简化参数生成词云仍然超时")
+        return None
+    return FallbackImage(image) if image is not None else None
+
+
+def warm_up_renderer() -> None:
+    """提前导入生成图片所需的 numpy、Pillow、wordcloud 和 emoji。
+
+    这些依赖导入较慢，插件加载时不会导入，而是在第一次生成词云或预热时导入。
+    """
+    import emoji  # noqa: F401
+    import numpy  # noqa: F401
+    import PIL.Image  # noqa: F401
+    import wordcloud  # noqa: F401
+
+
+async def warm_up() -> None:
+    """在工作线程中预热文本分析后端和图片生成依赖，并记录耗时。"""
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up_analyzer)
+        # 通过渲染工作池导入，使用进程工作池时可以提前启动子进程
+        await render_pool.run(warm_up_renderer)
+    except Exception:
+        logger.exception("词云预热失败")
+        return
+    logger.info(f"词云预热完成，耗时 {time.perf_counter() - start:.2f}s")
+
+
+async def start_warm_up() -> None:
+    """根据配置在后台启动预热任务，不阻塞机器人启动。"""
+    if not plugin_config.wordcloud_warmup:
+        return
+    task = asyncio.create_task(warm_up())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -1,9 +1,9 @@
-from datetime import time
+from datetime import date, datetime, time
 from enum import Enum
 
 from nonebot_plugin_alconna import Target
 from nonebot_plugin_orm import Model
-from sqlalchemy import JSON
+from sqlalchemy import JSON, String
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
@@ -74,3 +74,41 @@ class Schedule(Model):
             根据数据库中保存的 target 数据还原出的 Alconna Target。
         """
         return Target.load(self.target.copy())
+
+
+class MessageTokens(Model):
+    """消息的分词结果"""
+
+    digest: Mapped[str] = mapped_column(String(32), primary_key=True)
+    """消息内容与分析器配置的摘要"""
+    tokens: Mapped[list[str]] = mapped_column(JSON().with_variant(JSONB, "postgresql"))
+    """过滤后的词语列表"""
+    created_at: Mapped[datetime] = mapped_column(index=True)
+    """保存时间（UTC）"""
+
+
+class DailyWordCount(Model):
+    """每个会话每天的词频"""
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_persist_id: Mapped[int] = mapped_column(index=True)
+    """消息记录的会话 id"""
+    day: Mapped[date] = mapped_column(index=True)
+    """日期（插件时区）"""
+    fingerprint: Mapped[str] = mapped_column(String(64))
+    """汇总时的分析器配置摘要"""
+    counts: Mapped[dict[str, int]] = mapped_column(
+        JSON().with_variant(JSONB, "postgresql")
+    )
+    """词语及其出现次数"""
+
+
+class DailyRollup(Model):
+    """已经汇总词频的日期"""
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    """日期（插件时区）"""
+    fingerprint: Mapped[str] = mapped_column(String(64), primary_key=True)
+    """汇总时的分析器配置摘要"""
+    created_at: Mapped[datetime]
+    """汇总时间（UTC）"""
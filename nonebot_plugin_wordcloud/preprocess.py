@@ -0,0 +1,89 @@
+import re
+from functools import cache
+
+from .config import global_config
+
+URL_PATTERN = (
+    # https://stackoverflow.com/a/17773849/9212748
+    r"https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}"
+    r"|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}"
+    r"|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}"
+    r"|www\.[a-zA-Z0-9]+\.[^\s]{2,}"
+)
+"""网址"""
+CQ_CODE_PATTERN = r"\[CQ:[^\]]*\]"
+"""纯文本中残留的 CQ 码"""
+INVISIBLE_PATTERN = (
+    r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\u00ad\u061c\u180e"
+    r"\u200b-\u200f\u202a-\u202e\u2060-\u206f\ufeff\ufff9-\ufffb]"
+)
+"""零宽字符、方向控制字符和除换行、制表符以外的控制字符"""
+KEYCAP_PATTERN = r"[#*0-9]\ufe0f?\u20e3"
+"""键帽 emoji，其中的数字和符号本身不是 emoji"""
+
+
+def _get_emoji_pattern() -> str:
+    """根据 emoji 库的数据生成匹配 emoji 的字符集。
+
+    emoji 序列由修饰符、连接符等字符组成，逐个删除其中的字符即可删除
+    整个序列，因此无需像 `emoji.replace_emoji` 一样逐个匹配完整的序列。
+    """
+    from emoji import EMOJI_DATA
+
+    codepoints = sorted(
+        {ord(char) for emoji in EMOJI_DATA for char in emoji if not char.isascii()}
+    )
+    ranges: list[list[int]] = []
+    for codepoint in codepoints:
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return "[{}]+".format(
+        "".join(
+            re.escape(chr(start))
+            if start == stop
+            else f"{re.escape(chr(start))}-{re.escape(chr(stop))}"
+            for start, stop in ranges
+        )
+    )
+
+
+@cache
+def get_clean_pattern(command_start: tuple[str, ...] = ()) -> re.Pattern[str]:
+    """获取预处理消息时需要删除的内容的正则表达式。
+
+    所有规则合并为一个正则表达式，每条消息只需扫描一次。
+    第一次调用时导入 emoji 库并编译，之后复用编译结果。
+
+    Args:
+        command_start: 命令前缀，以这些前缀开头的行会被删除。
+
+    Returns:
+        编译后的正则表达式。
+    """
+    patterns = [URL_PATTERN, CQ_CODE_PATTERN, KEYCAP_PATTERN, _get_emoji_pattern()]
+    if command_start:
+        prefixes = "|".join(map(re.escape, command_start))
+        patterns.insert(0, f"^[ \\t]*(?:{prefixes})[^\\n]*")
+    patterns.append(f"{INVISIBLE_PATTERN}+")
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.M)
+
+
+def get_command_start() -> tuple[str, ...]:
+    """获取非空的命令前缀，较长的前缀在前。"""
+    return tuple(
+        sorted((i for i in global_config.command_start if i), key=len, reverse=True)
+    )
+
+
+def pre_precess(msg: str) -> str:
+    """对消息文本进行预处理。
+
+    Args:
+        msg: 原始消息文本。
+
+    Returns:
+        去除 URL、CQ 码、命令行、零宽字符、控制字符和 emoji 后的消息文本。
+    """
+    return get_clean_pattern(get_command_start()).sub("", msg)
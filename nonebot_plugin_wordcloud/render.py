@@ -0,0 +1,464 @@
+import asyncio
+import heapq
+import multiprocessing
+import os
+import sys
+import threading
+from collections import Counter
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, suppress
+from enum import IntEnum
+from functools import partial
+from itertools import count
+from typing import Any, TypeVar
+
+import nonebot
+from nonebot import logger
+from nonebot.compat import model_dump
+
+from .config import global_config, plugin_config
+
+T = TypeVar("T")
+
+
+class RenderPriority(IntEnum):
+    """生成词云的优先级，数值越小越先执行"""
+
+    INTERACTIVE = 0
+    """用户通过命令请求"""
+    SCHEDULED = 1
+    """定时发送"""
+
+
+def get_rss() -> int | None:
+    """获取当前进程的常驻内存大小。
+
+    Returns:
+        常驻内存字节数；当前平台无法获取时返回 None。
+    """
+    try:
+        with open("/proc/self/statm", encoding="utf8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 无法获取当前值时退而使用峰值，macOS 单位为字节，其他平台为 KB
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _run_task(func: Callable[..., T], *args: Any) -> tuple[T, int | None]:
+    """在工作线程或子进程中执行任务，并附带执行后的内存占用。"""
+    return func(*args), get_rss()
+
+
+def _run_thread_task(
+    notify: Callable[[], Any], func: Callable[..., T], *args: Any
+) -> tuple[T, int | None]:
+    """在工作线程中执行任务，开始执行时先调用 ``notify``。"""
+    notify()
+    return _run_task(func, *args)
+
+
+def _start_thread(func: Callable[..., T], *args: Any) -> Future[T]:
+    """在单独的线程中执行函数。
+
+    Args:
+        func: 需要执行的同步函数。
+        args: 传递给函数的位置参数。
+
+    Returns:
+        函数执行结果对应的 Future。
+    """
+    future: Future[T] = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="wordcloud-render-extra", daemon=True).start()
+    return future
+
+
+class ProcessWorkerPool(Executor):
+    """由多个单进程工作池组成的进程工作池。
+
+    每个子进程同时只执行一个任务，任务超时后可以单独结束执行它的子进程，
+    不影响其他子进程中正在执行的任务。同时执行的任务超过工作池大小时
+    临时创建子进程，任务结束后关闭。
+    """
+
+    def __init__(self, max_workers: int, **kwargs: Any):
+        self._max_workers = max(max_workers, 1)
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._idle: list[ProcessPoolExecutor] = []
+        self._busy: dict[Future, ProcessPoolExecutor] = {}
+        self._shutdown = False
+
+    def submit(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> Future[T]:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                worker = ProcessPoolExecutor(max_workers=1, **self._kwargs)
+            future = worker.submit(fn, *args, **kwargs)
+            self._busy[future] = worker
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Future) -> None:
+        """任务结束后归还子进程，子进程意外退出时直接丢弃。"""
+        broken = not future.cancelled() and isinstance(
+            future.exception(), BrokenProcessPool
+        )
+        with self._lock:
+            worker = self._busy.pop(future, None)
+            if worker is None:
+                return
+            if not (broken or self._shutdown) and len(self._idle) < self._max_workers:
+                self._idle.append(worker)
+                return
+        worker.shutdown(wait=False)
+
+    def terminate(self, future: Future) -> None:
+        """强制结束执行指定任务的子进程。
+
+        Args:
+            future: 需要结束的任务。
+        """
+        with self._lock:
+            worker = self._busy.pop(future, None)
+        if worker is None:
+            return
+        for process in list(getattr(worker, "_processes", {}).values()):
+            process.terminate()
+        worker.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            self._shutdown = True
+            workers = [*self._idle, *self._busy.values()]
+            self._idle = []
+        for worker in workers:
+            worker.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+class RenderPool:
+    """长期存在的词云渲染工作池。
+
+    工作池会在第一次使用时创建，并在执行一定数量的任务或内存占用超过上限后
+    整体替换，以控制渲染过程中的内存泄漏。
+    https://github.com/he0119/nonebot-plugin-wordcloud/issues/99
+
+    Args:
+        limiter: 生成词云的名额限制，线程中超时的任务会占用名额直到执行完毕。
+    """
+
+    def __init__(self, limiter: "RenderLimiter | None" = None):
+        self._lock = threading.Lock()
+        self._executor: Executor | None = None
+        self._workers = 0
+        self._tasks = 0
+        self._limiter = limiter
+        self._pending: Counter[Executor] = Counter()
+        """各线程工作池中尚未完成的任务数"""
+        self._timed_out: Counter[Executor] = Counter()
+        """各线程工作池中已经超时但仍在执行的任务数"""
+
+    def _create_executor(self) -> Executor:
+        workers = plugin_config.wordcloud_render_workers
+        if plugin_config.wordcloud_render_backend == "process":
+            # 使用 spawn 避免在多线程的事件循环进程中 fork
+            # 子进程需要先初始化 NoneBot 才能导入插件中的渲染函数
+            return ProcessWorkerPool(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=partial(nonebot.init, **model_dump(global_config)),
+            )
+        return ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="wordcloud-render"
+        )
+
+    def get_executor(self) -> Executor:
+        """获取当前工作池，不存在时按配置的后端创建。
+
+        Returns:
+            当前使用的执行器。
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+                self._workers = max(plugin_config.wordcloud_render_workers, 1)
+                self._tasks = 0
+            return self._executor
+
+    async def run(
+        self, func: Callable[..., T], *args: Any, timeout: float | None = None
+    ) -> T:
+        """在工作池中执行同步函数。
+
+        使用进程工作池时，超时后会强制结束执行该任务的子进程。线程无法被强制结束，
+        超时的任务会继续执行，并在结束前占用一个生成名额，避免超时的任务不断堆积。
+        线程工作池被超时的任务占满时，新的任务在单独的线程中执行，不会排在其后；
+        在线程中执行时从任务开始执行时计时，排队等待的时间不计入超时。
+        子进程意外退出时会在新的子进程中重试一次。
+
+        Args:
+            func: 需要执行的同步函数。
+            args: 传递给函数的位置参数。
+            timeout: 超时秒数，为空时不限制。
+
+        Returns:
+            函数的返回值。
+
+        Raises:
+            asyncio.TimeoutError: 执行超时。
+        """
+        try:
+            return await self._run(func, *args, timeout=timeout)
+        except BrokenProcessPool:
+            logger.warning("词云渲染子进程意外退出，在新的子进程中重试")
+            return await self._run(func, *args, timeout=timeout)
+
+    async def _run(
+        self, func: Callable[..., T], *args: Any, timeout: float | None
+    ) -> T:
+        executor = self.get_executor()
+        if isinstance(executor, ProcessWorkerPool):
+            # 每个任务都有单独的子进程，无需排队
+            future = executor.submit(_run_task, func, *args)
+            try:
+                result, rss = await asyncio.wait_for(
+                    asyncio.wrap_future(future), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.debug(f"词云渲染任务执行超过 {timeout}s")
+                executor.terminate(future)
+                raise
+            self._after_task(executor, rss)
+            return result
+
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        notify = partial(loop.call_soon_threadsafe, started.set)
+        pooled = not self._is_stalled(executor)
+        if pooled:
+            future = self._submit(executor, notify, func, *args)
+        else:
+            logger.debug("词云渲染工作池被超时的任务占满，在单独的线程中执行")
+            future = _start_thread(_run_thread_task, notify, func, *args)
+        waiter = asyncio.wrap_future(future)
+        try:
+            await self._wait_started(started, waiter)
+            result, rss = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            logger.debug(f"词云渲染任务执行超过 {timeout}s")
+            if pooled:
+                with self._lock:
+                    self._timed_out[executor] += 1
+                future.add_done_callback(
+                    partial(self._discount, self._timed_out, executor)
+                )
+            if self._limiter is not None:
+                self._limiter.hold(future)
+            raise
+        if pooled:
+            self._after_task(executor, rss)
+        return result
+
+    @staticmethod
+    async def _wait_started(started: asyncio.Event, waiter: asyncio.Future) -> None:
+        """等待线程中的任务开始执行，任务在开始前结束（如被取消）时直接返回。"""
+        start = asyncio.ensure_future(started.wait())
+        try:
+            await asyncio.wait({start, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            waiter.cancel()
+            raise
+        finally:
+            start.cancel()
+
+    def _is_stalled(self, executor: Executor) -> bool:
+        """线程工作池中没有空闲线程，且有线程被超时的任务占用。"""
+        with self._lock:
+            return bool(
+                self._timed_out[executor] and self._pending[executor] >= self._workers
+            )
+
+    def _submit(
+        self, executor: Executor, notify: Callable[[], Any], func: Callable, *args
+    ) -> Future:
+        with self._lock:
+            self._pending[executor] += 1
+        try:
+            future = executor.submit(_run_thread_task, notify, func, *args)
+        except BaseException:
+            self._discount(self._pending, executor, None)
+            raise
+        future.add_done_callback(partial(self._discount, self._pending, executor))
+        return future
+
+    def _discount(self, counter: Counter, executor: Executor, _: Future | None) -> None:
+        with self._lock:
+            counter[executor] -= 1
+            if counter[executor] <= 0:
+                del counter[executor]
+
+    def _after_task(self, executor: Executor, rss: int | None) -> None:
+        """统计已完成任务，必要时回收工作池。"""
+        max_tasks = plugin_config.wordcloud_render_max_tasks
+        max_rss = plugin_config.wordcloud_render_max_rss
+        with self._lock:
+            if executor is not self._executor:
+                return
+            self._tasks += 1
+            if max_tasks and self._tasks >= max_tasks:
+                reason = f"已执行 {self._tasks} 个任务"
+            elif max_rss and rss and rss > max_rss * 1024 * 1024:
+                reason = f"内存占用 {rss / 1024 / 1024:.0f}MB 超过上限"
+            else:
+                return
+        self._retire(executor, reason)
+
+    def _retire(self, executor: Executor, reason: str) -> None:
+        """替换指定的工作池。
+
+        Args:
+            executor: 需要替换的执行器。
+            reason: 替换原因，用于日志。
+        """
+        with self._lock:
+            if executor is self._executor:
+                self._executor = None
+        logger.debug(f"回收词云渲染工作池：{reason}")
+        # 正在执行的任务会继续完成，之后工作线程或子进程退出
+        executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """关闭工作池，取消尚未开始的任务。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class RenderLimiter:
+    """限制同时生成词云的数量，并按优先级排队。
+
+    同时生成的数量与渲染工作池大小一致，超出时按优先级排队，
+    相同优先级先到先得。
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._counter = count()
+
+    @property
+    def capacity(self) -> int:
+        return max(plugin_config.wordcloud_render_workers, 1)
+
+    @property
+    def active(self) -> int:
+        """正在生成的数量。"""
+        return self._active
+
+    def get_position(
+        self, priority: RenderPriority = RenderPriority.INTERACTIVE
+    ) -> int:
+        """获取按指定优先级加入时的排队位置。
+
+        Args:
+            priority: 加入队列的优先级。
+
+        Returns:
+            排队位置，为 0 时表示无需排队。
+        """
+        if self._active < self.capacity and not self._waiters:
+            return 0
+        ahead = sum(
+            1
+            for waiter_priority, _, future in self._waiters
+            if waiter_priority <= priority and not future.done()
+        )
+        return ahead + 1
+
+    @asynccontextmanager
+    async def acquire(
+        self, priority: RenderPriority = RenderPriority.INTERACTIVE
+    ) -> AsyncIterator[None]:
+        """获取生成名额，退出时释放。
+
+        Args:
+            priority: 排队优先级。
+        """
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def hold(self, future: Future) -> None:
+        """在后台任务结束前占用一个名额，不需要排队。
+
+        Args:
+            future: 需要等待结束的任务。
+        """
+        loop = asyncio.get_running_loop()
+        self._active += 1
+
+        def release(_: Future) -> None:
+            # 事件循环已经关闭时无需释放
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(self._release)
+
+        future.add_done_callback(release)
+
+    async def _acquire(self, priority: RenderPriority) -> None:
+        if self._active < self.capacity and not self._waiters:
+            self._active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._counter), future)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分配到名额但在恢复执行前被取消
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        while self._waiters and self._active < self.capacity:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+
+render_limiter = RenderLimiter()
+render_pool = RenderPool(render_limiter)
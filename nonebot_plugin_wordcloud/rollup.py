@@ -0,0 +1,297 @@
+import asyncio
+from collections import Counter, defaultdict
+from collections.abc import AsyncIterator, Sequence
+from datetime import date, datetime, time, timedelta, timezone
+
+from nonebot import logger
+from nonebot_plugin_apscheduler import scheduler
+from nonebot_plugin_chatrecorder import MessageRecord
+from nonebot_plugin_chatrecorder.record import filter_statement
+from nonebot_plugin_chatrecorder.utils import remove_timezone
+from nonebot_plugin_orm import get_session
+from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
+from sqlalchemy import delete, or_, select
+
+from .analyzer import get_word_analyzer
+from .cache import get_cache_key
+from .config import global_config, plugin_config
+from .data_source import (
+    CLOSED_PERIOD_DELAY,
+    count_messages_cached,
+    get_token_fingerprint,
+    iter_messages_plain_text,
+    paginate_messages,
+)
+from .model import DailyRollup, DailyWordCount
+from .utils import get_datetime_now_with_timezone
+
+ROLLUP_JOB_ID = "wordcloud_rollup"
+"""每天汇总词频的定时任务 id"""
+
+_background_tasks: set[asyncio.Task] = set()
+_rollup_lock = asyncio.Lock()
+
+
+def is_rollup_enabled() -> bool:
+    """是否按天汇总词频。
+
+    限制复读消息计入次数时，不同用户发送的相同消息需要合并计算，
+    而汇总结果按会话（包括用户）保存，无法还原，因此不汇总。
+    """
+    return bool(
+        plugin_config.wordcloud_rollup_days and not plugin_config.wordcloud_repeat_limit
+    )
+
+
+def get_rollup_fingerprint() -> str:
+    """获取会影响按天汇总结果的配置摘要，配置变化后不再使用旧的汇总。
+
+    Returns:
+        分词配置、复读消息计入次数、命令前缀与划分日期所用时区的摘要。
+    """
+    return get_cache_key(
+        get_token_fingerprint(),
+        plugin_config.wordcloud_repeat_limit,
+        sorted(global_config.command_start),
+        str(get_datetime_now_with_timezone().tzinfo),
+    )
+
+
+def get_day_range(day: date) -> tuple[datetime, datetime]:
+    """获取某天在插件时区中的起止时间。
+
+    Args:
+        day: 日期。
+
+    Returns:
+        当天的开始时间与下一天的开始时间。
+    """
+    tz = get_datetime_now_with_timezone().tzinfo
+    return (
+        datetime.combine(day, time(), tzinfo=tz),
+        datetime.combine(day + timedelta(days=1), time(), tzinfo=tz),
+    )
+
+
+async def rollup_day(day: date, fingerprint: str) -> None:
+    """统计某天每个会话收到的消息的词频并保存。
+
+    Args:
+        day: 需要汇总的日期。
+        fingerprint: `get_rollup_fingerprint` 的结果。
+    """
+    analyzer = await asyncio.to_thread(get_word_analyzer)
+    token_fingerprint = await asyncio.to_thread(get_token_fingerprint)
+    start, stop = get_day_range(day)
+    statement = select(
+        MessageRecord.id, MessageRecord.session_persist_id, MessageRecord.plain_text
+    ).where(
+        MessageRecord.type == "message",
+        MessageRecord.time >= remove_timezone(start),
+        MessageRecord.time < remove_timezone(stop),
+    )
+
+    session_counts: defaultdict[int, Counter[str]] = defaultdict(Counter)
+    async for rows in paginate_messages(statement):
+        session_messages: defaultdict[int, list[str]] = defaultdict(list)
+        for _, session_id, plain_text in rows:
+            session_messages[session_id].append(plain_text)
+        for session_id, messages in session_messages.items():
+            session_counts[session_id].update(
+                await count_messages_cached(analyzer, token_fingerprint, messages)
+            )
+
+    async with get_session() as db_session:
+        db_session.add_all(
+            DailyWordCount(
+                session_persist_id=session_id,
+                day=day,
+                fingerprint=fingerprint,
+                counts=dict(counts),
+            )
+            for session_id, counts in session_counts.items()
+            if counts
+        )
+        db_session.add(
+            DailyRollup(
+                day=day,
+                fingerprint=fingerprint,
+                created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+            )
+        )
+        await db_session.commit()
+
+
+async def rollup_word_counts() -> None:
+    """汇总最近 ``wordcloud_rollup_days`` 天中尚未汇总的日期。
+
+    同时删除超出天数或配置已经变化的汇总。从最近的日期开始汇总，
+    某天汇总失败时停止，等待下一次执行。
+    """
+    if not is_rollup_enabled():
+        return
+
+    days = plugin_config.wordcloud_rollup_days
+    async with _rollup_lock:
+        fingerprint = await asyncio.to_thread(get_rollup_fingerprint)
+        now = get_datetime_now_with_timezone()
+        oldest = now.date() - timedelta(days=days)
+        async with get_session() as db_session:
+            for model in (DailyWordCount, DailyRollup):
+                await db_session.execute(
+                    delete(model).where(
+                        or_(model.fingerprint != fingerprint, model.day < oldest)
+                    )
+                )
+            await db_session.commit()
+            finished = set(
+                await db_session.scalars(
+                    select(DailyRollup.day).where(
+                        DailyRollup.fingerprint == fingerprint
+                    )
+                )
+            )
+
+        count = 0
+        for i in range(1, days + 1):
+            day = now.date() - timedelta(days=i)
+            if day in finished or get_day_range(day)[1] > now - CLOSED_PERIOD_DELAY:
+                continue
+            try:
+                await rollup_day(day, fingerprint)
+            except Exception:
+                logger.exception(f"汇总 {day} 的词频失败")
+                break
+            count += 1
+        if count:
+            logger.info(f"已汇总 {count} 天的词频")
+
+
+async def get_rollup_days(
+    start: datetime, stop: datetime, fingerprint: str
+) -> list[date]:
+    """获取查询范围内已经汇总的完整日期。
+
+    Args:
+        start: 查询开始时间。
+        stop: 查询结束时间。
+        fingerprint: `get_rollup_fingerprint` 的结果。
+
+    Returns:
+        按时间顺序排列的日期。
+    """
+    tz = get_datetime_now_with_timezone().tzinfo
+    async with get_session() as db_session:
+        days = await db_session.scalars(
+            select(DailyRollup.day)
+            .where(
+                DailyRollup.fingerprint == fingerprint,
+                DailyRollup.day >= start.astimezone(tz).date(),
+                DailyRollup.day <= stop.astimezone(tz).date(),
+            )
+            .order_by(DailyRollup.day)
+        )
+        return [
+            day
+            for day in days
+            if get_day_range(day)[0] >= start and get_day_range(day)[1] <= stop
+        ]
+
+
+async def get_day_counts(day: date, fingerprint: str, **kwargs) -> Counter[str]:
+    """合并某天符合筛选条件的会话的词频。
+
+    Args:
+        day: 已经汇总的日期。
+        fingerprint: `get_rollup_fingerprint` 的结果。
+        **kwargs: 筛选参数，不包括时间和消息类型。
+
+    Returns:
+        词语及其出现次数。
+    """
+    whereclause = filter_statement(**kwargs)
+    statement = (
+        select(DailyWordCount.counts)
+        .where(
+            *whereclause,
+            DailyWordCount.day == day,
+            DailyWordCount.fingerprint == fingerprint,
+        )
+        .join(SessionModel, SessionModel.id == DailyWordCount.session_persist_id)
+        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
+        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
+        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    )
+    counts: Counter[str] = Counter()
+    async with get_session() as db_session:
+        for session_counts in await db_session.scalars(statement):
+            counts.update(session_counts)
+    return counts
+
+
+async def iter_message_batches(**kwargs) -> AsyncIterator[Sequence[str] | Counter[str]]:
+    """分批获取消息文本，已经按天汇总的日期直接返回当天的词频。
+
+    只有开启汇总、查询收到的消息并指定了起止时间时才会使用汇总结果，
+    时间范围中没有汇总的部分（如今天）仍然分批读取消息。
+
+    Args:
+        **kwargs: 筛选参数，与 `iter_messages_plain_text` 相同。
+
+    Yields:
+        每批消息的纯文本，或某天的词频。
+    """
+    start = kwargs.get("time_start")
+    stop = kwargs.get("time_stop")
+    if (
+        not is_rollup_enabled()
+        or start is None
+        or stop is None
+        or list(kwargs.get("types") or []) != ["message"]
+    ):
+        async for batch in iter_messages_plain_text(**kwargs):
+            yield batch
+        return
+
+    filters = {
+        key: value
+        for key, value in kwargs.items()
+        if key not in ("time_start", "time_stop", "types")
+    }
+    fingerprint = await asyncio.to_thread(get_rollup_fingerprint)
+    cursor = start
+    for day in await get_rollup_days(start, stop, fingerprint):
+        day_start, day_stop = get_day_range(day)
+        if cursor < day_start:
+            # 查询的结束时间包含在内，需要排除当天开始时的消息
+            async for batch in iter_messages_plain_text(
+                **{
+                    **kwargs,
+                    "time_start": cursor,
+                    "time_stop": day_start - timedelta(microseconds=1),
+                }
+            ):
+                yield batch
+        yield await get_day_counts(day, fingerprint, **filters)
+        cursor = day_stop
+    if cursor <= stop:
+        async for batch in iter_messages_plain_text(**{**kwargs, "time_start": cursor}):
+            yield batch
+
+
+async def start_rollup() -> None:
+    """根据配置添加每天汇总词频的定时任务，并在后台汇总之前的日期。"""
+    if not is_rollup_enabled():
+        return
+    scheduler.add_job(
+        rollup_word_counts,
+        "cron",
+        hour=0,
+        minute=10,
+        timezone=get_datetime_now_with_timezone().tzinfo,
+        id=ROLLUP_JOB_ID,
+        replace_existing=True,
+    )
+    task = asyncio.create_task(rollup_word_counts())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -1,22 +1,34 @@
+from collections import Counter
+from collections.abc import AsyncIterator, Sequence
 from datetime import datetime, time
+from functools import partial
 from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
 from nonebot.log import logger
-from nonebot_plugin_alconna import Image, Target, Text, UniMessage
+from nonebot_plugin_alconna import Target, Text, UniMessage
 from nonebot_plugin_apscheduler import scheduler
-from nonebot_plugin_chatrecorder import get_messages_plain_text
 from nonebot_plugin_orm import get_session
 from nonebot_plugin_uninfo import SceneType
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from .cache import wordcloud_cache
 from .config import plugin_config
-from .data_source import get_wordcloud
+from .data_source import (
+    analyse_many,
+    get_render_preset,
+    get_wordcloud,
+    get_wordcloud_cache_key,
+    render_wordcloud,
+)
 from .model import Schedule, ScheduleMode, ScheduleType
+from .render import RenderPriority
+from .rollup import iter_message_batches
 from .utils import (
     get_current_period_range,
     get_datetime_now_with_timezone,
+    get_image_segment,
     get_mask_key,
     get_previous_period_range,
     get_time_with_scheduler_timezone,
@@ -28,6 +40,9 @@ from .utils import (
 if TYPE_CHECKING:
     from apscheduler.job import Job
 
+SCHEDULE_ANALYSE_CHUNK_SIZE = 32
+"""定时发送时每次一起分析的会话数量，分析完这些会话的词云后再分析下一批"""
+
 
 def dump_target(target: Target) -> dict:
     """序列化 Alconna 发送目标。
@@ -179,11 +194,74 @@ class Scheduler:
             None,
         )
 
+    @staticmethod
+    def iter_messages(
+        target: Target, start: datetime, stop: datetime
+    ) -> AsyncIterator[Sequence[str] | Counter[str]]:
+        """分批读取发送目标的聊天记录。
+
+        Args:
+            target: Alconna 发送目标。
+            start: 查询开始时间。
+            stop: 查询结束时间。
+
+        Returns:
+            分批的消息文本与按天汇总的词频。
+        """
+        return iter_message_batches(
+            scopes=[target.scope] if target.scope else None,
+            scene_types=[get_target_scene_type(target)],
+            scene_ids=[target.id],
+            filter_self_id=False,
+            filter_adapter=False,
+            filter_user=False,
+            types=["message"],
+            time_start=start,
+            time_stop=stop,
+            exclude_user_ids=plugin_config.wordcloud_exclude_user_ids,
+        )
+
+    @classmethod
+    async def create_wordcloud(
+        cls,
+        target: Target,
+        start: datetime,
+        stop: datetime,
+        mask_key: str,
+        frequency: dict[str, float] | None = None,
+    ) -> bytes | None:
+        """查询发送目标的聊天记录并生成词云图片。
+
+        Args:
+            target: Alconna 发送目标。
+            start: 查询开始时间。
+            stop: 查询结束时间。
+            mask_key: 发送目标对应的 mask key。
+            frequency: 已经分析好的词频；为空时查询聊天记录并分析。
+
+        Returns:
+            词云图片字节；数据不足时返回 None。
+        """
+        preset = get_render_preset(mask_key, start, stop)
+        if frequency is not None:
+            return await render_wordcloud(
+                frequency, mask_key, priority=RenderPriority.SCHEDULED, preset=preset
+            )
+        return await get_wordcloud(
+            cls.iter_messages(target, start, stop),
+            mask_key,
+            priority=RenderPriority.SCHEDULED,
+            preset=preset,
+        )
+
     async def run_task(
         self, time: time | None = None, schedule_mode: ScheduleMode | None = None
     ):
         """执行定时发送任务。
 
+        需要发送的会话按 ``SCHEDULE_ANALYSE_CHUNK_SIZE`` 分组，每组先一起分析
+        没有缓存的会话的聊天记录，再逐个生成并发送词云。
+
         Args:
             time: 数据库中保存的 UTC 定时时间；为空时执行默认任务。
             schedule_mode: 默认任务需要筛选的发送模式。
@@ -204,6 +282,7 @@ class Scheduler:
             )
             logger.info(f"开始发送定时词云，时间为 {time_text}")
             dt = get_datetime_now_with_timezone()
+            tasks = []
             for schedule in schedules:
                 if not (
                     time_range := get_schedule_time_range(
@@ -213,38 +292,54 @@ class Scheduler:
                     )
                 ):
                     continue
-                start, stop = time_range
-                target = schedule.alc_target
-                messages = await get_messages_plain_text(
-                    scopes=[target.scope] if target.scope else None,
-                    scene_types=[get_target_scene_type(target)],
-                    scene_ids=[target.id],
-                    filter_self_id=False,
-                    filter_adapter=False,
-                    filter_user=False,
-                    types=["message"],
-                    time_start=start,
-                    time_stop=stop,
-                    exclude_user_ids=plugin_config.wordcloud_exclude_user_ids,
-                )
-                mask_key = get_mask_key(target)
+                tasks.append((schedule, schedule.alc_target, *time_range))
+
+            for i in range(0, len(tasks), SCHEDULE_ANALYSE_CHUNK_SIZE):
+                await self._run_chunk(tasks[i : i + SCHEDULE_ANALYSE_CHUNK_SIZE])
+
+    async def _run_chunk(
+        self, tasks: list[tuple[Schedule, Target, datetime, datetime]]
+    ) -> None:
+        """一起分析一组会话的聊天记录，然后逐个生成并发送词云。"""
+        keys = {}
+        messages = {}
+        for schedule, target, start, stop in tasks:
+            mask_key = get_mask_key(target)
+            cache_key, cache_ttl = get_wordcloud_cache_key(mask_key, start, stop)
+            keys[schedule.id] = (mask_key, cache_key, cache_ttl)
+            if await wordcloud_cache.get(cache_key) is None:
+                messages[cache_key] = self.iter_messages(target, start, stop)
+        frequencies = await analyse_many(messages)
+
+        for schedule, target, start, stop in tasks:
+            mask_key, cache_key, cache_ttl = keys[schedule.id]
+            image = await wordcloud_cache.get_or_create(
+                cache_key,
+                partial(
+                    self.create_wordcloud,
+                    target,
+                    start,
+                    stop,
+                    mask_key,
+                    frequencies.get(cache_key),
+                ),
+                ttl=cache_ttl,
+            )
 
-                if image := await get_wordcloud(messages, mask_key):
-                    msg = Image(raw=image)
-                else:
-                    msg = Text(
-                        "今天没有足够的数据生成词云"
-                        if schedule.schedule_mode == ScheduleMode.PERIOD_END
-                        and schedule.schedule_type == ScheduleType.DAY
-                        else "这段时间没有足够的数据生成词云"
-                    )
+            if image:
+                msg = get_image_segment(image)
+            else:
+                msg = Text(
+                    "今天没有足够的数据生成词云"
+                    if schedule.schedule_mode == ScheduleMode.PERIOD_END
+                    and schedule.schedule_type == ScheduleType.DAY
+                    else "这段时间没有足够的数据生成词云"
+                )
 
-                try:
-                    await target.send(UniMessage(msg))
-                except Exception:
-                    logger.exception(
-                        f"{target} 发送{schedule.schedule_type.value}词云失败"
-                    )
+            try:
+                await target.send(UniMessage(msg))
+            except Exception:
+                logger.exception(f"{target} 发送{schedule.schedule_type.value}词云失败")
 
     async def get_schedule(
         self, target: Target, schedule_type: ScheduleType = ScheduleType.DAY
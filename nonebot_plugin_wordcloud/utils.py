@@ -1,15 +1,44 @@
 from datetime import datetime, time, timedelta, tzinfo
+from functools import cache
+from importlib.metadata import PackageNotFoundError, version
 from zoneinfo import ZoneInfo
 
 from nonebot.matcher import Matcher
-from nonebot_plugin_alconna import Target
+from nonebot_plugin_alconna import Image, Target
 from nonebot_plugin_apscheduler import scheduler
 from nonebot_plugin_uninfo import SceneType, Session, UniSession
 
-from .config import plugin_config
+from .config import IMAGE_FORMATS, plugin_config
 from .model import ScheduleType
 
 
+def get_image_segment(raw: bytes, name: str = "image") -> Image:
+    """构造词云图片消息段，文件扩展名和 MIME 类型与配置的图片格式一致。
+
+    Args:
+        raw: 图片字节。
+        name: 不含扩展名的文件名。
+
+    Returns:
+        图片消息段。
+    """
+    extension, mimetype = IMAGE_FORMATS[plugin_config.wordcloud_image_format]
+    return Image(raw=raw, name=f"{name}.{extension}", mimetype=mimetype)
+
+
+@cache
+def get_plugin_version() -> str | None:
+    """获取已安装的插件版本。
+
+    Returns:
+        插件版本号；未通过包管理器安装时返回 None。
+    """
+    try:
+        return version("nonebot-plugin-wordcloud")
+    except PackageNotFoundError:
+        return None
+
+
 def get_datetime_now_with_timezone() -> datetime:
     """获取包含时区信息的当前时间。
 
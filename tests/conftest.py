@@ -40,6 +40,8 @@ def pytest_configure(config: pytest.Config) -> None:
         "command_start": {"/", ""},
         "permission_superusers": [],
         "wordcloud_analyzer": "jieba",
+        # 缓存会影响其他测试对 get_wordcloud 的调用断言，需要时在测试中开启
+        "wordcloud_cache_size": 0,
     }
     config.stash[NONEBOT_START_LIFESPAN] = False
 
@@ -98,7 +100,12 @@ async def clear_database():
     from nonebot_plugin_user.models import Bind
     from nonebot_plugin_user.models import User as UserModelByPluginUser
 
-    from nonebot_plugin_wordcloud.model import Schedule
+    from nonebot_plugin_wordcloud.model import (
+        DailyRollup,
+        DailyWordCount,
+        MessageTokens,
+        Schedule,
+    )
 
     async with get_session() as session, session.begin():
         is_mysql = session.bind.dialect.name == "mysql"
@@ -111,6 +118,9 @@ async def clear_database():
         try:
             await session.execute(delete(MessageRecord))
             await session.execute(delete(Schedule))
+            await session.execute(delete(MessageTokens))
+            await session.execute(delete(DailyWordCount))
+            await session.execute(delete(DailyRollup))
             await session.execute(delete(SessionModel))
 
             await session.execute(delete(AclDependencyModel))
@@ -195,9 +205,13 @@ async def app(app: App, tmp_path: Path, mocker: MockerFixture):
     mocker.patch("nonebot_plugin_orm._data_dir", orm_dir)
     from nonebot_plugin_orm import init_orm
 
+    from nonebot_plugin_wordcloud.cache import mask_cache, token_cache, wordcloud_cache
     from nonebot_plugin_wordcloud.schedule import schedule_service
 
     await init_orm()
+    wordcloud_cache.clear()
+    mask_cache.clear()
+    token_cache.clear()
 
     from nonebot_plugin_permission import system as permission_system
 
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 
 import pytest
@@ -42,8 +43,8 @@ async def test_rjieba_analyzer_uses_real_segmentation(
     app: App, mocker: MockerFixture, mode: str, expected: dict[str, float]
 ):
     """测试 rjieba 后端使用真实 rjieba 分词结果统计词频"""
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     mocker.patch.object(plugin_config, "wordcloud_analyzer", "rjieba")
     mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {"mode": mode})
@@ -55,10 +56,199 @@ async def test_rjieba_analyzer_uses_real_segmentation(
     assert frequency == expected
 
 
+@pytest.mark.parametrize("analyzer", ["jieba", "rjieba"])
+async def test_analyse_messages(app: App, mocker: MockerFixture, analyzer: str):
+    """测试逐条分词并合并多条消息的词频"""
+    from collections import Counter
+
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", analyzer)
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+
+    word_analyzer = get_word_analyzer()
+    messages = ["今天天气不错", "今天天气真不错", "不错"]
+
+    counts = word_analyzer.count(messages)
+    assert counts == sum(map(word_analyzer.count, [[m] for m in messages]), Counter())
+    assert word_analyzer.analyse_messages(messages) == word_analyzer.weigh(counts)
+    # 分析单条文本等同于只有一条消息
+    assert word_analyzer.analyse("今天天气不错") == word_analyzer.analyse_messages(
+        ["今天天气不错"]
+    )
+
+
+@pytest.mark.parametrize("token_cache_size", [0, 32])
+async def test_analyse_message_batches_parallel(
+    app: App, mocker: MockerFixture, token_cache_size: int
+):
+    """测试消息数量超过阈值后在子进程中并行分词，结果与单线程一致"""
+    import os
+
+    from nonebot_plugin_wordcloud.analyzer import AnalyzerPool
+    from nonebot_plugin_wordcloud.cache import token_cache
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import analyse_message_batches
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_size", token_cache_size)
+
+    batches = [
+        ["今天天气不错", "/今日词云"],
+        ["明天天气也不错", "今天天气不错"],
+        ["下雨天气真冷"],
+        ["天气预报说要下雨", "今天天气不错"],
+    ]
+
+    async def iter_batches():
+        for batch in batches:
+            yield batch
+
+    expected = await analyse_message_batches(iter_batches())
+    token_cache.clear()
+
+    pool = AnalyzerPool()
+    mocker.patch("nonebot_plugin_wordcloud.data_source.analyzer_pool", pool)
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_workers", 2)
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_parallel_threshold", 3)
+    spy = mocker.spy(pool, "run")
+    try:
+        assert await analyse_message_batches(iter_batches()) == pytest.approx(expected)
+        # 第一批未超过阈值，仍在当前进程中分词
+        assert spy.call_count == 3
+        assert await pool.run(os.getpid) != os.getpid()
+    finally:
+        pool.shutdown()
+
+
+async def test_analyzer_pool_warm_up(app: App, mocker: MockerFixture):
+    """测试分词子进程启动时在初始化函数中预热分析器"""
+    from pkgutil import resolve_name
+
+    from nonebot_plugin_wordcloud.analyzer import AnalyzerPool
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_workers", 2)
+    pool = AnalyzerPool()
+    name = "nonebot_plugin_wordcloud.analyzer:analyzer_registry._key"
+    try:
+        # 两个子进程执行的第一个任务都能用到已经加载的分析器
+        results = await asyncio.gather(
+            pool.run(resolve_name, name), pool.run(resolve_name, name)
+        )
+        assert all(result is not None for result in results)
+    finally:
+        pool.shutdown()
+
+
+async def test_analyse_many(app: App, mocker: MockerFixture):
+    """测试一起分析多个会话的消息，结果与逐个分析一致"""
+    from collections import Counter
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        _iter_single_batch,
+        analyse_many,
+        analyse_message_batches,
+    )
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+
+    async def iter_batches():
+        yield ["今天天气不错", "/今日词云"]
+        yield Counter({"天气": 2})
+
+    messages = {
+        "10000": ["今天天气不错", "明天天气也不错"],
+        "10001": iter_batches(),
+        "10002": [],
+    }
+    result = await analyse_many(messages)
+
+    assert list(result) == ["10000", "10001", "10002"]
+    assert result["10000"] == await analyse_message_batches(
+        _iter_single_batch(["今天天气不错", "明天天气也不错"])
+    )
+    assert result["10001"] == await analyse_message_batches(iter_batches())
+    assert result["10002"] == {}
+
+
+@pytest.mark.parametrize("token_cache_size", [0, 32])
+@pytest.mark.parametrize(("repeat_limit", "repeat"), [(0, 5), (1, 1), (3, 3)])
+async def test_count_repeated_messages(
+    app: App,
+    mocker: MockerFixture,
+    token_cache_size: int,
+    repeat_limit: int,
+    repeat: int,
+):
+    """测试相同的消息只分词一次，并按配置限制计入的次数"""
+    from collections import Counter
+
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        count_messages_cached,
+        get_token_fingerprint,
+    )
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_size", token_cache_size)
+    mocker.patch.object(plugin_config, "wordcloud_repeat_limit", repeat_limit)
+
+    analyzer = get_word_analyzer()
+    spy = mocker.spy(analyzer, "cut")
+    # 预处理后相同的消息视为复读
+    messages = ["今天天气不错", " 今天天气不错😅", "明天下雨", *["今天天气不错"] * 3]
+
+    counts = await count_messages_cached(analyzer, get_token_fingerprint(), messages)
+
+    assert counts == Counter({"今天天气": repeat, "不错": repeat, "明天": 1, "下雨": 1})
+    assert spy.call_count == 2
+
+
+@pytest.mark.parametrize("token_cache_size", [0, 32])
+async def test_count_repeated_messages_across_batches(
+    app: App, mocker: MockerFixture, token_cache_size: int
+):
+    """测试复读的消息按整个查询限制计入的次数，而不是每批消息分别限制"""
+    from collections import Counter
+
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        WordCounter,
+        get_token_fingerprint,
+    )
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_size", token_cache_size)
+    mocker.patch.object(plugin_config, "wordcloud_repeat_limit", 2)
+
+    async def iter_batches():
+        yield ["今天天气不错", "明天下雨"]
+        yield ["今天天气不错", "今天天气不错"]
+        yield ["今天天气不错", "明天下雨"]
+
+    counter = WordCounter(get_word_analyzer(), get_token_fingerprint())
+    counts = await counter.count(iter_batches())
+
+    assert counts == Counter({"今天天气": 2, "不错": 2, "明天": 2, "下雨": 2})
+
+
 async def test_rjieba_analyzer_filters_short_words(app: App, mocker: MockerFixture):
     """测试 rjieba 后端会读取配置过滤过短词语"""
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     mocker.patch.object(plugin_config, "wordcloud_analyzer", "rjieba")
     mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {"mode": "search"})
@@ -75,8 +265,8 @@ async def test_rjieba_analyzer_filters_stopwords(app: App, mocker: MockerFixture
     """测试 rjieba 后端会按停用词过滤真实分词结果"""
     from nonebot_plugin_localstore import get_data_file
 
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     stopwords = get_data_file("nonebot_plugin_wordcloud", "rjieba-stopwords.txt")
     stopwords.write_text("今天天气\n", encoding="utf8")
@@ -91,14 +281,51 @@ async def test_rjieba_analyzer_filters_stopwords(app: App, mocker: MockerFixture
     assert frequency == {"不错": 1.0, "真不错": 1.0}
 
 
+async def test_jieba_analyzer_filters_short_words(app: App, mocker: MockerFixture):
+    """测试 jieba 后端同样读取配置过滤过短词语和纯标点"""
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+
+    analyzer = get_word_analyzer()
+    assert list(analyzer.cut("今天天气不错！！！")) == ["今天天气", "不错"]
+
+    mocker.patch.object(plugin_config, "wordcloud_min_word_length", 3)
+    assert list(analyzer.cut("今天天气不错！！！")) == ["今天天气"]
+
+
+@pytest.mark.parametrize("analyzer", ["jieba", "rjieba"])
+async def test_analyzer_exclude_words(app: App, mocker: MockerFixture, analyzer: str):
+    """测试按正则表达式和数字规则排除词语"""
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", analyzer)
+    mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+
+    word_analyzer = get_word_analyzer()
+    text = "哈哈哈 今天天气不错 2024 666 test2"
+    assert {"哈哈哈", "2024", "666", "test2"} <= set(word_analyzer.cut(text))
+
+    mocker.patch.object(plugin_config, "wordcloud_exclude_words", ["哈+", "test\\d"])
+    mocker.patch.object(plugin_config, "wordcloud_exclude_numeric_words", True)
+    assert set(word_analyzer.cut(text)) == {"今天天气", "不错"}
+
+
 async def test_rjieba_analyzer_warns_unsupported_userdict(
     app: App, mocker: MockerFixture
 ):
     """测试 rjieba 后端使用用户词典时会给出明确警告"""
     from nonebot_plugin_localstore import get_data_file
 
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     userdict = get_data_file("nonebot_plugin_wordcloud", "rjieba-userdict.txt")
     userdict.write_text("小脑芙\n", encoding="utf8")
@@ -118,9 +345,11 @@ async def test_rjieba_analyzer_warns_unsupported_userdict(
 
 async def test_rjieba_analyzer_missing_dependency(app: App, mocker: MockerFixture):
     """测试 rjieba 后端缺少依赖时给出明确提示"""
+    from nonebot_plugin_wordcloud.analyzer import analyse_message, analyzer_registry
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
+    # 同一进程中之前的测试可能已经加载了 rjieba 分析器
+    analyzer_registry.clear()
     mocker.patch.dict(sys.modules, {"rjieba": None})
     mocker.patch.object(plugin_config, "wordcloud_analyzer", "rjieba")
     mocker.patch.object(plugin_config, "wordcloud_analyzer_options", {})
@@ -140,3 +369,71 @@ async def test_get_word_analyzer_invalid_backend(app: App, mocker: MockerFixture
 
     with pytest.raises(ValueError, match="不支持的词云分析后端: unknown"):
         get_word_analyzer()
+
+
+async def test_word_analyzer_is_reused(app: App, mocker: MockerFixture):
+    """测试分析器在配置未变化时被复用，词典文件变化后重新加载"""
+    from nonebot_plugin_localstore import get_data_file
+
+    from nonebot_plugin_wordcloud.analyzer import analyse_message, get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    stopwords = get_data_file("nonebot_plugin_wordcloud", "reuse-stopwords.txt")
+    stopwords.write_text("奇怪\n", encoding="utf8")
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", stopwords)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+
+    analyzer = get_word_analyzer()
+    assert get_word_analyzer() is analyzer
+    assert analyse_message("这是一个奇怪的句子。").keys() == {"这是", "一个", "句子"}
+
+    stopwords.write_text("奇怪\n句子\n", encoding="utf8")
+
+    assert get_word_analyzer() is not analyzer
+    assert analyse_message("这是一个奇怪的句子。").keys() == {"这是", "一个"}
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "rjieba")
+
+    assert not isinstance(get_word_analyzer(), type(analyzer))
+
+
+async def test_warm_up(app: App, mocker: MockerFixture):
+    """测试启动时在后台预热分析后端"""
+    from nonebot_plugin_wordcloud import data_source
+    from nonebot_plugin_wordcloud.analyzer import analyzer_registry
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "jieba")
+    mocker.patch.object(plugin_config, "wordcloud_stopwords_path", None)
+    mocker.patch.object(plugin_config, "wordcloud_userdict_path", None)
+    mocked_info = mocker.patch("nonebot_plugin_wordcloud.data_source.logger.info")
+    analyzer_registry.clear()
+
+    mocker.patch.object(plugin_config, "wordcloud_warmup", False)
+    await data_source.start_warm_up()
+    assert not data_source._background_tasks
+
+    mocker.patch.object(plugin_config, "wordcloud_warmup", True)
+    await data_source.start_warm_up()
+    (task,) = data_source._background_tasks
+    await task
+
+    assert analyzer_registry._analyzer is not None
+    assert mocked_info.call_args.args[0].startswith("词云预热完成")
+
+
+async def test_warm_up_failed(app: App, mocker: MockerFixture):
+    """测试预热失败时只记录日志"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import warm_up
+
+    mocker.patch.object(plugin_config, "wordcloud_analyzer", "unknown")
+    mocked_exception = mocker.patch(
+        "nonebot_plugin_wordcloud.data_source.logger.exception"
+    )
+
+    await warm_up()
+
+    mocked_exception.assert_called_once_with("词云预热失败")
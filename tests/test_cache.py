@@ -0,0 +1,323 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from nonebot import get_adapter
+from nonebot.adapters.onebot.v11 import Adapter, Bot, Message
+from nonebug import App
+from pytest_mock import MockerFixture
+
+from .utils import fake_group_message_event_v11, should_send_image
+
+
+async def test_cache_lru(app: App, mocker: MockerFixture):
+    """测试缓存按字节数淘汰最久未使用的图片"""
+    from nonebot_plugin_wordcloud.cache import WordcloudCache
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_cache_disk_size", 0)
+
+    cache = WordcloudCache()
+    half = 512 * 1024
+    await cache.set("a", b"a" * half)
+    await cache.set("b", b"b" * half)
+    assert await cache.get("a") is not None
+
+    await cache.set("c", b"c" * half)
+
+    assert await cache.get("a") is not None
+    assert await cache.get("b") is None
+    assert await cache.get("c") is not None
+    assert cache.size == 2 * half
+
+    # 超过容量的图片不会缓存
+    await cache.set("d", b"d" * (1024 * 1024 + 1))
+    assert await cache.get("d") is None
+
+
+async def test_cache_ttl(app: App, mocker: MockerFixture):
+    """测试尚未结束时间段的缓存会过期"""
+    from nonebot_plugin_wordcloud.cache import WordcloudCache
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_cache_disk_size", 0)
+    mocked_time = mocker.patch(
+        "nonebot_plugin_wordcloud.cache.time.monotonic", return_value=100
+    )
+
+    cache = WordcloudCache()
+    await cache.set("open", b"open", ttl=60)
+    await cache.set("closed", b"closed")
+    await cache.set("disabled", b"disabled", ttl=0)
+
+    assert await cache.get("open") == b"open"
+    assert await cache.get("disabled") is None
+
+    mocked_time.return_value = 161
+    assert await cache.get("open") is None
+    assert await cache.get("closed") == b"closed"
+    assert cache.size == len(b"closed")
+
+
+async def test_cache_disk(app: App, mocker: MockerFixture):
+    """测试已结束时间段的缓存会保存到磁盘"""
+    from nonebot_plugin_wordcloud.cache import WordcloudCache
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_cache_disk_size", 1)
+
+    cache = WordcloudCache()
+    await cache.set("closed", b"closed")
+    await cache.set("open", b"open", ttl=60)
+
+    assert plugin_config.get_cache_path("closed").read_bytes() == b"closed"
+    assert not plugin_config.get_cache_path("open").exists()
+
+    # 重启后仍可从磁盘读取
+    cache = WordcloudCache()
+    assert await cache.get("closed") == b"closed"
+    assert await cache.get("open") is None
+
+    # 超过容量时删除最旧的文件
+    await cache.set("large", b"l" * 1024 * 1024)
+    assert not plugin_config.get_cache_path("closed").exists()
+    assert plugin_config.get_cache_path("large").exists()
+
+    # 关闭内存缓存时仍然使用磁盘缓存
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 0)
+    cache = WordcloudCache()
+    await cache.set("disk", b"disk")
+    assert cache.size == 0
+    assert plugin_config.get_cache_path("disk").read_bytes() == b"disk"
+    assert await cache.get("disk") == b"disk"
+
+
+async def test_get_wordcloud_cache_key(app: App, mocker: MockerFixture):
+    """测试缓存 key 区分时间段、用户和 mask"""
+    import shutil
+    from unittest.mock import patch
+
+    from nonebot_plugin_wordcloud.config import DATA_DIR, global_config, plugin_config
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud_cache_key
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_ttl", 30)
+
+    now = datetime.now().astimezone()
+    yesterday = now - timedelta(days=1)
+    today = now - timedelta(hours=1)
+
+    key, ttl = get_wordcloud_cache_key("QQClient_10000", yesterday, today)
+    assert ttl is None
+    assert get_wordcloud_cache_key("QQClient_10000", yesterday, today)[0] == key
+    assert get_wordcloud_cache_key("QQClient_10000", yesterday, today, ["10"])[0] != key
+    assert get_wordcloud_cache_key("QQClient_10001", yesterday, today)[0] != key
+
+    # 尚未结束的时间段忽略结束时间
+    open_key, ttl = get_wordcloud_cache_key("QQClient_10000", yesterday, now)
+    assert ttl == 30
+    assert (
+        get_wordcloud_cache_key(
+            "QQClient_10000", yesterday, now + timedelta(seconds=20)
+        )[0]
+        == open_key
+    )
+
+    # 升级插件或修改命令前缀后缓存失效
+    with patch(
+        "nonebot_plugin_wordcloud.data_source.get_plugin_version",
+        return_value="999.0.0",
+    ):
+        assert get_wordcloud_cache_key("QQClient_10000", yesterday, today)[0] != key
+    with patch.object(global_config, "command_start", {"#"}):
+        assert get_wordcloud_cache_key("QQClient_10000", yesterday, today)[0] != key
+    assert get_wordcloud_cache_key("QQClient_10000", yesterday, today)[0] == key
+
+    # 修改 mask 后缓存失效
+    shutil.copy(Path(__file__).parent / "mask.png", DATA_DIR / "mask.png")
+    assert get_wordcloud_cache_key("QQClient_10000", yesterday, today)[0] != key
+
+
+async def test_wordcloud_cmd_cached(app: App, mocker: MockerFixture):
+    """测试重复请求直接使用缓存的图片"""
+    from nonebot_plugin_wordcloud import wordcloud_cmd
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 1)
+
+    image = (Path(__file__).parent / "test_wordcloud.png").read_bytes()
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.iter_message_batches",
+        return_value=["天气"],
+    )
+    mocked_get_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.get_wordcloud", return_value=image
+    )
+
+    for _ in range(2):
+        async with app.test_matcher(wordcloud_cmd) as ctx:
+            adapter = get_adapter(Adapter)
+            bot = ctx.create_bot(base=Bot, adapter=adapter, auto_connect=False)
+            event = fake_group_message_event_v11(message=Message("/今日词云"))
+
+            ctx.receive_event(bot, event)
+            should_send_image(ctx, bot, event, image, name="wordcloud.png")
+            ctx.should_finished(wordcloud_cmd)
+
+    mocked_iter_message_batches.assert_called_once()
+    mocked_get_wordcloud.assert_called_once()
+
+
+async def test_cache_single_flight(app: App, mocker: MockerFixture):
+    """测试相同的并发请求只生成一次图片"""
+    import asyncio
+
+    from nonebot_plugin_wordcloud.cache import WordcloudCache
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 0)
+
+    cache = WordcloudCache()
+    event = asyncio.Event()
+    create = mocker.AsyncMock(return_value=b"image")
+
+    async def create_image():
+        await event.wait()
+        return await create()
+
+    tasks = [
+        asyncio.create_task(cache.get_or_create("key", create_image)) for _ in range(5)
+    ]
+    other = asyncio.create_task(cache.get_or_create("other", create_image))
+    await asyncio.sleep(0)
+    # 取消其中一个请求不会影响其他请求
+    tasks.pop().cancel()
+    event.set()
+
+    assert await asyncio.gather(*tasks) == [b"image"] * 4
+    assert await other == b"image"
+    assert create.await_count == 2
+    assert not cache._single_flight._tasks
+
+
+async def test_token_cache(app: App, mocker: MockerFixture):
+    """测试重复分析的消息使用缓存的分词结果"""
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.cache import token_cache
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        analyse_message_batches,
+        analyse_messages,
+    )
+
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_persist", False)
+    cut = mocker.spy(get_word_analyzer(), "cut")
+
+    async def iter_batches(*batches: list[str]):
+        for batch in batches:
+            yield batch
+
+    messages = ["今天天气不错", "/今日词云", "今天天气不错", "明天天气也不错"]
+    expected = analyse_messages(messages)
+    cut.reset_mock()
+
+    assert await analyse_message_batches(iter_batches(messages)) == expected
+    assert cut.call_count == 2
+    assert token_cache.size > 0
+
+    cut.reset_mock()
+    assert await analyse_message_batches(
+        iter_batches(messages[:2], messages[2:])
+    ) == pytest.approx(expected)
+    cut.assert_not_called()
+
+    # 只对新消息分词
+    await analyse_message_batches(iter_batches([*messages, "后天下雨"]))
+    cut.assert_called_once()
+
+    # 分析参数变化后重新分词
+    cut.reset_mock()
+    mocker.patch.object(
+        plugin_config, "wordcloud_analyzer_options", {"allowPOS": ["n"]}
+    )
+    await analyse_message_batches(iter_batches(messages))
+    assert cut.call_count == 2
+
+
+async def test_token_store(app: App, mocker: MockerFixture):
+    """测试分词结果保存到数据库，并删除过期的记录"""
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import func, select
+
+    from nonebot_plugin_wordcloud.analyzer import get_word_analyzer
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        analyse_message_batches,
+        token_store,
+    )
+    from nonebot_plugin_wordcloud.model import MessageTokens
+
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_size", 0)
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_persist", True)
+    cut = mocker.spy(get_word_analyzer(), "cut")
+
+    async def iter_batches():
+        yield ["今天天气不错", "明天天气也不错"]
+
+    expected = await analyse_message_batches(iter_batches())
+    assert cut.call_count == 2
+
+    cut.reset_mock()
+    assert await analyse_message_batches(iter_batches()) == expected
+    cut.assert_not_called()
+
+    async with get_session() as session:
+        assert await session.scalar(select(func.count(MessageTokens.digest))) == 2
+        record = await session.scalar(select(MessageTokens).limit(1))
+        assert record
+        record.created_at = datetime.now() - timedelta(days=31)
+        await session.commit()
+
+    await token_store.purge()
+
+    async with get_session() as session:
+        assert await session.scalar(select(func.count(MessageTokens.digest))) == 1
+        record = await session.scalar(select(MessageTokens))
+        assert record
+
+    # 其他任务已经保存的消息不影响其余分词结果的保存
+    await token_store.set_many({record.digest: ("天气",), "new": ("不错",)})
+    assert await token_store.get_many([record.digest, "new"]) == {
+        record.digest: tuple(record.tokens),
+        "new": ("不错",),
+    }
+
+
+async def test_start_token_purge(app: App, mocker: MockerFixture):
+    """测试保存分词结果时添加删除过期记录的定时任务"""
+    from nonebot_plugin_apscheduler import scheduler
+
+    from nonebot_plugin_wordcloud import data_source
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    purge = mocker.spy(data_source.token_store, "purge")
+
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_persist", False)
+    await data_source.start_token_purge()
+    assert scheduler.get_job(data_source.TOKEN_PURGE_JOB_ID) is None
+
+    mocker.patch.object(plugin_config, "wordcloud_token_cache_persist", True)
+    await data_source.start_token_purge()
+    for task in list(data_source._background_tasks):
+        await task
+
+    assert scheduler.get_job(data_source.TOKEN_PURGE_JOB_ID) is not None
+    purge.assert_called_once()
+    scheduler.remove_job(data_source.TOKEN_PURGE_JOB_ID)
+
+    # 保存分词结果时不再删除过期记录
+    await data_source.token_store.set_many({"digest": ("天气",)})
+    purge.assert_called_once()
@@ -64,6 +64,17 @@ async def test_default_schedule_mode_enum(app: App):
     assert config.wordcloud_default_schedule_time.isoformat() == "23:59:59+08:00"
 
 
+async def test_exclude_words_invalid_pattern(app: App):
+    """测试排除词语的正则表达式无效时校验失败"""
+    from nonebot_plugin_wordcloud.config import Config
+
+    config = type_validate_python(Config, {"wordcloud_exclude_words": [r"\d+"]})
+    assert config.wordcloud_exclude_words == [r"\d+"]
+
+    with pytest.raises(ValueError, match="无效的正则表达式"):
+        type_validate_python(Config, {"wordcloud_exclude_words": ["[a-"]})
+
+
 @pytest.mark.parametrize(
     "default_config",
     [
@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+IMPORT_TIME_BUDGET = 2.0
+"""加载插件自身（不含依赖插件）允许的最长耗时（秒）"""
+
+HEAVY_MODULES = ("numpy", "PIL.Image", "wordcloud", "emoji", "jieba", "rjieba")
+
+SCRIPT = """
+import json
+import sys
+import time
+
+import nonebot
+
+nonebot.init(
+    driver="~fastapi+~httpx",
+    sqlalchemy_database_url="sqlite+aiosqlite://",
+    alembic_startup_check=False,
+    localstore_cache_dir={tmp!r},
+    localstore_config_dir={tmp!r},
+    localstore_data_dir={tmp!r},
+)
+# 先加载依赖插件，只统计插件自身的加载耗时
+for plugin in (
+    "nonebot_plugin_apscheduler",
+    "nonebot_plugin_alconna",
+    "nonebot_plugin_uninfo",
+    "nonebot_plugin_chatrecorder",
+    "nonebot_plugin_permission",
+):
+    nonebot.require(plugin)
+
+start = time.perf_counter()
+nonebot.load_plugin("nonebot_plugin_wordcloud")
+elapsed = time.perf_counter() - start
+print(
+    json.dumps(
+        {{
+            "elapsed": elapsed,
+            "loaded": [name for name in {modules!r} if name in sys.modules],
+        }}
+    )
+)
+"""
+
+
+def test_import_time(tmp_path: Path):
+    """测试加载插件时不会导入生成图片和分词的重型依赖，且耗时在预算内"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            SCRIPT.format(tmp=str(tmp_path), modules=HEAVY_MODULES),
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+        cwd=tmp_path,
+    )
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert data["loaded"] == []
+    assert data["elapsed"] < IMPORT_TIME_BUDGET, data["elapsed"]
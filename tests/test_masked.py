@@ -48,6 +48,158 @@ async def test_masked(app: App, mocker: MockerFixture):
     mocked_random.assert_called()
 
 
+async def test_masked_occupancy_cache(app: App, mocker: MockerFixture):
+    """测试复用 mask 的初始占用积分图"""
+    import wordcloud.wordcloud
+
+    from nonebot_plugin_wordcloud.cache import mask_cache
+    from nonebot_plugin_wordcloud.config import DATA_DIR, plugin_config
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud
+
+    mocker.patch.object(plugin_config, "wordcloud_background_color", "white")
+    shutil.copy(Path(__file__).parent / "mask.png", DATA_DIR / "mask.png")
+    test_image = PILImage.open(Path(__file__).parent / "test_masked.png")
+
+    cumsum_counts = []
+    for _ in range(2):
+        mocker.patch("wordcloud.wordcloud.Random", return_value=random.Random(0))
+        mocked_cumsum = mocker.spy(wordcloud.wordcloud.np, "cumsum")
+
+        image_byte = await get_wordcloud(["示例", "插件", "测试"], "")
+
+        assert image_byte is not None
+        image = PILImage.open(BytesIO(image_byte))
+        assert ImageChops.difference(image, test_image).getbbox() is None
+        assert any(key.endswith("#occupancy-1920x1200") for key in mask_cache._entries)
+        cumsum_counts.append(mocked_cumsum.call_count)
+        mocker.stop(mocked_cumsum)
+
+    # 第二次生成时不再根据 mask 计算积分图
+    assert cumsum_counts[1] < cumsum_counts[0]
+
+
+async def test_mask_cache(app: App, mocker: MockerFixture):
+    """测试 mask 缓存在文件变化后失效"""
+    import os
+
+    from nonebot_plugin_wordcloud.cache import mask_cache
+    from nonebot_plugin_wordcloud.config import DATA_DIR, plugin_config
+    from nonebot_plugin_wordcloud.data_source import load_mask
+
+    mask_path = DATA_DIR / "mask.png"
+    shutil.copy(Path(__file__).parent / "mask.png", mask_path)
+
+    mask = load_mask(mask_path, 1920, 1200)
+    assert not mask.flags.writeable
+    assert load_mask(mask_path, 1920, 1200) is mask
+    assert mask_cache.size == mask.nbytes
+
+    # 修改文件后重新读取
+    PILImage.new("RGB", (10, 20), "white").save(mask_path)
+    stat = mask_path.stat()
+    os.utime(mask_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    new_mask = load_mask(mask_path, 1920, 1200)
+    assert new_mask is not mask
+    assert new_mask.shape == (20, 10)
+    assert mask_cache.size == new_mask.nbytes
+
+    # 超过上限时不缓存
+    mocker.patch.object(plugin_config, "wordcloud_mask_cache_size", 0)
+    mask_cache.clear()
+    assert load_mask(mask_path, 1920, 1200) is not load_mask(mask_path, 1920, 1200)
+    assert mask_cache.size == 0
+
+
+async def test_bake_mask(app: App):
+    """测试 mask 预处理"""
+    import numpy as np
+
+    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import get_baked_mask_path, load_mask
+
+    # 与 WordCloud 的判断一致：只有纯白色不绘制
+    image = PILImage.new("RGB", (400, 200), "white")
+    image.paste((0, 0, 0), (0, 0, 200, 200))
+    image.paste((254, 255, 255), (200, 0, 300, 200))
+    mask_path = DATA_DIR / "mask.png"
+    image.save(mask_path)
+
+    mask = load_mask(mask_path, 100, 100)
+    assert get_baked_mask_path(mask_path, 100, 100).exists()
+    # 缩小到画布以内并保持比例
+    assert mask.shape == (50, 100)
+    assert mask.dtype == np.uint8
+    assert set(np.unique(mask)) == {0, 255}
+    assert (mask[:, :75] == 0).all()
+    assert (mask[:, 76:] == 255).all()
+
+    # 比画布小的图片不放大
+    assert load_mask(mask_path, 1920, 1200).shape == (200, 400)
+
+
+async def test_masked_preset_size(app: App):
+    """测试使用 mask 时图片大小与渲染预设无关"""
+    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud
+
+    image = PILImage.new("RGB", (400, 300), "white")
+    image.paste((0, 0, 0), (50, 50, 350, 250))
+    image.save(DATA_DIR / "mask.png")
+
+    sizes = {}
+    for preset in ("quality", "balanced", "fast"):
+        image_byte = await get_wordcloud(["示例", "插件", "测试"], "", preset=preset)
+        assert image_byte is not None
+        sizes[preset] = PILImage.open(BytesIO(image_byte)).size
+
+    assert sizes == {"quality": (400, 300), "balanced": (400, 300), "fast": (400, 300)}
+
+
+async def test_mask_store(app: App):
+    """测试相同的 mask 只保存一份"""
+    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import (
+        get_baked_mask_path,
+        get_mask_path,
+        mask_store,
+        remove_mask,
+        save_mask,
+    )
+
+    image = (Path(__file__).parent / "mask.png").read_bytes()
+    # 同一张图片重新编码后内容相同
+    image_bytes = BytesIO()
+    PILImage.open(BytesIO(image)).save(image_bytes, format="PNG", compress_level=1)
+    assert image_bytes.getvalue() != image
+
+    # 旧版本按会话保存的图片
+    legacy_path = DATA_DIR / "mask-QQClient_10000.png"
+    shutil.copy(Path(__file__).parent / "mask.png", legacy_path)
+    assert get_mask_path("QQClient_10000") == legacy_path
+
+    save_mask(image, "QQClient_10000")
+    save_mask(image_bytes.getvalue(), "QQClient_10001")
+    assert not legacy_path.exists()
+
+    mask_path = mask_store.get_path("QQClient_10000")
+    assert mask_path
+    assert mask_store.get_path("QQClient_10001") == mask_path
+    assert list((DATA_DIR / "masks").glob("*.png")) == [mask_path]
+    assert get_baked_mask_path(mask_path, 1920, 1200).exists()
+    assert mask_store.get_refcount(mask_path.stem) == 2
+
+    # 仍有会话使用时保留图片
+    remove_mask("QQClient_10000")
+    assert get_mask_path("QQClient_10000") is None
+    assert mask_path.exists()
+    assert mask_store.get_refcount(mask_path.stem) == 1
+
+    # 没有会话使用时删除图片及其预处理结果
+    remove_mask("QQClient_10001")
+    assert not mask_path.exists()
+    assert not list((DATA_DIR / "masks").iterdir())
+
+
 async def test_masked_by_command(app: App, mocker: MockerFixture):
     """测试自定义图片形状"""
 
@@ -59,8 +211,8 @@ async def test_masked_by_command(app: App, mocker: MockerFixture):
     mask_path = Path(__file__).parent / "mask.png"
     shutil.copy(mask_path, DATA_DIR / "mask.png")
 
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.iter_message_batches",
         return_value=["示例", "插件", "测试"],
     )
 
@@ -82,9 +234,9 @@ async def test_masked_by_command(app: App, mocker: MockerFixture):
         should_send_image(ctx, bot, event, test_image, name="wordcloud.png")
         ctx.should_finished(wordcloud_cmd)
 
-    mocked_get_messages_plain_text.assert_called_once()
+    mocked_iter_message_batches.assert_called_once()
     mocked_get_wordcloud.assert_called_once_with(
-        ["示例", "插件", "测试"], "QQClient_10000"
+        ["示例", "插件", "测试"], "QQClient_10000", preset="quality"
     )
 
 
@@ -120,6 +272,7 @@ async def test_set_mask_default(app: App, respx_mock: respx.MockRouter):
     """测试自定义图片形状"""
     from nonebot_plugin_wordcloud import set_mask_cmd
     from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import mask_store
     from nonebot_plugin_wordcloud.permissions import (
         WORDCLOUD_DEFAULT_MASK_PERMISSION,
         WORDCLOUD_MASK_PERMISSION,
@@ -172,7 +325,9 @@ async def test_set_mask_default(app: App, respx_mock: respx.MockRouter):
         ctx.should_call_send(event, "词云默认形状设置成功", True)
         ctx.should_finished()
 
-    assert (DATA_DIR / "mask.png").exists()
+    mask_path = mask_store.get_path()
+    assert mask_path
+    assert mask_path.parent == DATA_DIR / "masks"
     assert image_url.call_count == 1
 
 
@@ -181,6 +336,7 @@ async def test_set_mask(app: App, respx_mock: respx.MockRouter):
     """测试自定义图片形状"""
     from nonebot_plugin_wordcloud import set_mask_cmd
     from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import get_baked_mask_path, mask_store
     from nonebot_plugin_wordcloud.permissions import WORDCLOUD_MASK_PERMISSION
 
     image_url = respx_mock.get("https://test").mock(
@@ -189,7 +345,7 @@ async def test_set_mask(app: App, respx_mock: respx.MockRouter):
         )
     )
 
-    assert not (DATA_DIR / "mask-QQClient_10000.png").exists()
+    assert mask_store.get_path("QQClient_10000") is None
 
     session = cache_onebot11_session(21)
     await grant_wordcloud_permission(session.scope, 21, WORDCLOUD_MASK_PERMISSION)
@@ -209,13 +365,16 @@ async def test_set_mask(app: App, respx_mock: respx.MockRouter):
         ctx.should_finished()
 
     assert image_url.call_count == 1
-    assert (DATA_DIR / "mask-QQClient_10000.png").exists()
+    mask_path = mask_store.get_path("QQClient_10000")
+    assert mask_path
+    assert mask_path.parent == DATA_DIR / "masks"
+    assert get_baked_mask_path(mask_path, 1920, 1200).exists()
 
 
 @respx.mock(assert_all_called=False)
 async def test_set_mask_without_mask_permission(app: App, respx_mock: respx.MockRouter):
     from nonebot_plugin_wordcloud import set_mask_cmd
-    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import mask_store
     from nonebot_plugin_wordcloud.permissions import (
         WORDCLOUD_DEFAULT_MASK_PERMISSION,
         WORDCLOUD_MASK_PERMISSION,
@@ -227,8 +386,7 @@ async def test_set_mask_without_mask_permission(app: App, respx_mock: respx.Mock
         )
     )
 
-    mask_path = DATA_DIR / "mask-QQClient_10000.png"
-    assert not mask_path.exists()
+    assert mask_store.get_path("QQClient_10000") is None
 
     session = cache_onebot11_session(27)
     await grant_wordcloud_permission(
@@ -252,7 +410,7 @@ async def test_set_mask_without_mask_permission(app: App, respx_mock: respx.Mock
         ctx.should_finished()
 
     assert image_url.call_count == 0
-    assert not mask_path.exists()
+    assert mask_store.get_path("QQClient_10000") is None
 
 
 async def test_set_mask_rejects_when_image_fetch_returns_none(
@@ -260,7 +418,7 @@ async def test_set_mask_rejects_when_image_fetch_returns_none(
 ):
     """图片获取失败时，继续等待用户重新发送词云形状"""
     from nonebot_plugin_wordcloud import set_mask_cmd
-    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import mask_store
     from nonebot_plugin_wordcloud.permissions import WORDCLOUD_MASK_PERMISSION
 
     mask_image = (Path(__file__).parent / "mask.png").read_bytes()
@@ -295,7 +453,7 @@ async def test_set_mask_rejects_when_image_fetch_returns_none(
         ctx.should_finished()
 
     assert mocked_image_fetch.call_count == 2
-    assert (DATA_DIR / "mask-QQClient_10000.png").exists()
+    assert mask_store.get_path("QQClient_10000")
 
 
 async def test_set_default_mask_permission_rechecked_after_prompt(
@@ -398,7 +556,7 @@ async def test_set_mask_permission_rechecked_after_prompt(
 async def test_set_mask_get_args(app: App, respx_mock: respx.MockRouter):
     """测试自定义图片形状，需要额外获取图片时的情况"""
     from nonebot_plugin_wordcloud import set_mask_cmd
-    from nonebot_plugin_wordcloud.config import DATA_DIR
+    from nonebot_plugin_wordcloud.data_source import mask_store
     from nonebot_plugin_wordcloud.permissions import WORDCLOUD_MASK_PERMISSION
 
     image_url = respx_mock.get("https://test").mock(
@@ -440,7 +598,7 @@ async def test_set_mask_get_args(app: App, respx_mock: respx.MockRouter):
         ctx.should_call_send(image_event, "词云形状设置成功", True)
         ctx.should_finished()
 
-    assert (DATA_DIR / "mask-QQClient_10000.png").exists()
+    assert mask_store.get_path("QQClient_10000")
     assert image_url.call_count == 1
 
 
@@ -513,6 +671,8 @@ async def test_remove_mask(app: App):
 
     shutil.copy(mask_path, mask_default_path)
     shutil.copy(mask_path, mask_group_path)
+    baked_group_path = DATA_DIR / "mask-QQClient_10000.png.1920x1200.npy"
+    baked_group_path.touch()
 
     assert mask_default_path.exists()
     assert mask_group_path.exists()
@@ -534,6 +694,7 @@ async def test_remove_mask(app: App):
 
     assert mask_default_path.exists()
     assert not mask_group_path.exists()
+    assert not baked_group_path.exists()
 
 
 async def test_remove_mask_without_mask_permission(app: App):
@@ -132,7 +132,7 @@ async def test_query_other_permission_granted_by_permission_plugin(
         return_value=datetime(2022, 1, 2, 23, tzinfo=ZoneInfo("Asia/Shanghai")),
     )
     mocked_get_messages = mocker.patch(
-        "nonebot_plugin_wordcloud.get_messages_plain_text",
+        "nonebot_plugin_wordcloud.iter_message_batches",
         return_value=["target-user-message"],
     )
     mocker.patch(
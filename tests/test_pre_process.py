@@ -27,3 +27,43 @@ async def test_remove_http(app: App):
     msg = "1 https://api.weibo.cn/share/312975272,470873388.html?weibo_id=4770873388 2"
     msg = pre_precess(msg)
     assert msg == "1  2"
+
+
+async def test_remove_invisible(app: App):
+    """测试移除零宽字符和控制字符"""
+
+    from nonebot_plugin_wordcloud.data_source import pre_precess
+
+    msg = "今\u200b天\u200d天\ufeff气\x00不\u202e错\n真的\t不错"
+    msg = pre_precess(msg)
+    assert msg == "今天天气不错\n真的\t不错"
+
+
+async def test_remove_cq_code(app: App):
+    """测试移除残留的 CQ 码"""
+
+    from nonebot_plugin_wordcloud.data_source import pre_precess
+
+    msg = "1[CQ:image,file=abc.image,url=https://example.com]2[CQ:face,id=1]3"
+    msg = pre_precess(msg)
+    assert msg == "123"
+
+
+async def test_remove_keycap_emoji(app: App):
+    """测试移除键帽 emoji，保留普通的数字"""
+
+    from nonebot_plugin_wordcloud.data_source import pre_precess
+
+    msg = "1\ufe0f\u20e32#\u20e33"
+    msg = pre_precess(msg)
+    assert msg == "23"
+
+
+async def test_remove_command_lines(app: App):
+    """测试移除以命令前缀开头的行"""
+
+    from nonebot_plugin_wordcloud.data_source import pre_precess
+
+    msg = "今天天气不错\n  /今日词云\n真不错 /test"
+    msg = pre_precess(msg)
+    assert msg == "今天天气不错\n\n真不错 /test"
@@ -0,0 +1,272 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from nonebot import get_adapter
+from nonebot.adapters.onebot.v11 import Adapter, Bot, Message
+from nonebug import App
+from pytest_mock import MockerFixture
+
+from .utils import fake_group_message_event_v11, should_send_image
+
+
+async def test_render_pool_reuse(app: App, mocker: MockerFixture):
+    """测试渲染工作池在多次任务之间复用"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 0)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", None)
+
+    pool = RenderPool()
+    executor = pool.get_executor()
+
+    assert await pool.run(sum, [1, 2, 3]) == 6
+    name = await pool.run(lambda: threading.current_thread().name)
+    assert name.startswith("wordcloud-render")
+    assert pool.get_executor() is executor
+
+    pool.shutdown()
+    assert pool._executor is None
+
+
+async def test_render_pool_recycle_by_tasks(app: App, mocker: MockerFixture):
+    """测试渲染工作池执行指定数量任务后回收"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 2)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", None)
+
+    pool = RenderPool()
+    executor = pool.get_executor()
+
+    await pool.run(sum, [1])
+    assert pool.get_executor() is executor
+
+    await pool.run(sum, [1])
+    assert pool.get_executor() is not executor
+
+    pool.shutdown()
+
+
+async def test_render_pool_recycle_by_rss(app: App, mocker: MockerFixture):
+    """测试渲染工作池内存占用超过上限后回收"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 0)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", 100)
+    mocked_rss = mocker.patch(
+        "nonebot_plugin_wordcloud.render.get_rss", return_value=50 * 1024 * 1024
+    )
+
+    pool = RenderPool()
+    executor = pool.get_executor()
+
+    await pool.run(sum, [1])
+    assert pool.get_executor() is executor
+
+    mocked_rss.return_value = 200 * 1024 * 1024
+    await pool.run(sum, [1])
+    assert pool.get_executor() is not executor
+
+    pool.shutdown()
+
+
+async def test_get_rss(app: App):
+    """测试获取当前进程内存占用"""
+    from nonebot_plugin_wordcloud.render import get_rss
+
+    rss = get_rss()
+    assert rss is None or rss > 0
+
+
+async def test_render_pool_timeout(app: App, mocker: MockerFixture):
+    """测试线程中的任务超时后继续占用名额直到执行完毕"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderLimiter, RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_workers", 1)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 0)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", None)
+
+    limiter = RenderLimiter()
+    pool = RenderPool(limiter)
+    executor = pool.get_executor()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await pool.run(time.sleep, 1, timeout=0.1)
+    # 不会创建新的工作池，线程数量不会因为超时的任务增加
+    assert pool.get_executor() is executor
+    assert limiter.active == 1
+
+    # 唯一的工作线程被超时的任务占用，之后的任务在单独的线程中执行
+    name = await pool.run(lambda: threading.current_thread().name, timeout=0.5)
+    assert name == "wordcloud-render-extra"
+
+    for _ in range(50):
+        if limiter.active == 0:
+            break
+        await asyncio.sleep(0.1)
+    assert limiter.active == 0
+    name = await pool.run(lambda: threading.current_thread().name, timeout=0.5)
+    assert name.startswith("wordcloud-render_")
+
+    pool.shutdown()
+
+
+async def test_render_pool_timeout_after_start(app: App, mocker: MockerFixture):
+    """测试排队等待的时间不计入超时"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_workers", 1)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 0)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", None)
+
+    pool = RenderPool()
+    busy = asyncio.create_task(pool.run(time.sleep, 0.6))
+    await asyncio.sleep(0)
+    assert await pool.run(sum, [1, 2], timeout=0.3) == 3
+    await busy
+
+    pool.shutdown()
+
+
+async def test_render_pool_process(app: App, mocker: MockerFixture):
+    """测试使用进程工作池生成词云"""
+    import os
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        _get_wordcloud,
+        get_wordcloud_options,
+    )
+    from nonebot_plugin_wordcloud.render import RenderPool
+
+    mocker.patch.object(plugin_config, "wordcloud_render_backend", "process")
+    mocker.patch.object(plugin_config, "wordcloud_render_workers", 2)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_tasks", 0)
+    mocker.patch.object(plugin_config, "wordcloud_render_max_rss", None)
+
+    pool = RenderPool()
+    try:
+        assert await pool.run(os.getpid) != os.getpid()
+
+        image = await pool.run(
+            _get_wordcloud, {"天气": 1.0}, get_wordcloud_options(), None
+        )
+        assert image is not None
+        assert image.startswith(b"\x89PNG")
+
+        # 超时后只结束执行该任务的子进程，其他子进程中的任务不受影响
+        spy = mocker.spy(pool, "_run")
+        pid = await pool.run(os.getpid)
+        other = asyncio.create_task(pool.run(time.sleep, 3))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(time.sleep, 30, timeout=0.5)
+        assert await other is None
+        assert spy.call_count == 3
+        assert await pool.run(os.getpid) == pid
+    finally:
+        pool.shutdown()
+
+
+async def test_render_limiter_priority(app: App, mocker: MockerFixture):
+    """测试超出并发数时按优先级排队"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderLimiter, RenderPriority
+
+    mocker.patch.object(plugin_config, "wordcloud_render_workers", 1)
+
+    limiter = RenderLimiter()
+    order: list[str] = []
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire():
+            started.set()
+            await release.wait()
+
+    async def job(name: str, priority: RenderPriority):
+        async with limiter.acquire(priority):
+            order.append(name)
+
+    assert limiter.get_position() == 0
+    holder = asyncio.create_task(hold())
+    await started.wait()
+
+    scheduled = asyncio.create_task(job("scheduled", RenderPriority.SCHEDULED))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(job("interactive", RenderPriority.INTERACTIVE))
+    cancelled = asyncio.create_task(job("cancelled", RenderPriority.INTERACTIVE))
+    await asyncio.sleep(0)
+
+    # 用户请求排在定时任务之前
+    assert limiter.get_position(RenderPriority.INTERACTIVE) == 3
+    assert limiter.get_position(RenderPriority.SCHEDULED) == 4
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    assert limiter.get_position(RenderPriority.INTERACTIVE) == 2
+
+    release.set()
+    await asyncio.gather(holder, scheduled, interactive)
+
+    assert order == ["interactive", "scheduled"]
+    assert limiter.active == 0
+    assert limiter.get_position() == 0
+
+
+async def test_get_wordcloud_limit_render_only(app: App, mocker: MockerFixture):
+    """测试分析消息时不占用渲染名额"""
+    from nonebot_plugin_wordcloud import data_source
+    from nonebot_plugin_wordcloud.render import render_limiter
+
+    active: list[int] = []
+
+    async def analyse(messages):
+        active.append(render_limiter.active)
+        return {"天气": 1.0}
+
+    async def render(frequency, mask_key, preset):
+        active.append(render_limiter.active)
+        return b"image"
+
+    mocker.patch.object(data_source, "analyse_message_batches", new=analyse)
+    mocker.patch.object(data_source, "_render_wordcloud", new=render)
+
+    assert await data_source.get_wordcloud(["今天天气不错"], "mask") == b"image"
+    assert active == [0, 1]
+    assert render_limiter.active == 0
+
+
+async def test_wordcloud_cmd_queue_notice(app: App, mocker: MockerFixture):
+    """测试排队时提示用户"""
+    from nonebot_plugin_wordcloud import wordcloud_cmd
+
+    image = (Path(__file__).parent / "test_wordcloud.png").read_bytes()
+    mocker.patch("nonebot_plugin_wordcloud.iter_message_batches", return_value=["天气"])
+    mocker.patch("nonebot_plugin_wordcloud.get_wordcloud", return_value=image)
+    mocker.patch("nonebot_plugin_wordcloud.render_limiter.get_position", return_value=3)
+
+    async with app.test_matcher(wordcloud_cmd) as ctx:
+        adapter = get_adapter(Adapter)
+        bot = ctx.create_bot(base=Bot, adapter=adapter, auto_connect=False)
+        event = fake_group_message_event_v11(message=Message("/今日词云"))
+
+        ctx.receive_event(bot, event)
+        ctx.should_call_send(
+            event,
+            "当前生成词云的请求较多，已加入队列，排在第 3 位",
+            True,
+            at_sender=False,
+            reply=False,
+        )
+        should_send_image(ctx, bot, event, image, name="wordcloud.png")
+        ctx.should_finished(wordcloud_cmd)
@@ -0,0 +1,245 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+from nonebug import App
+from pytest_mock import MockerFixture
+
+TZ = ZoneInfo("Asia/Shanghai")
+
+
+@pytest.fixture
+async def _message_record(app: App):
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_orm import get_session
+    from nonebot_plugin_uninfo import (
+        Scene,
+        SceneType,
+        Session,
+        SupportAdapter,
+        SupportScope,
+        User,
+    )
+    from nonebot_plugin_uninfo.orm import get_session_persist_id
+
+    session_ids = [
+        await get_session_persist_id(
+            Session(
+                self_id="test",
+                adapter=SupportAdapter.onebot11,
+                scope=SupportScope.qq_client,
+                scene=Scene("10000", SceneType.GROUP),
+                user=User(user_id),
+            )
+        )
+        for user_id in ("10", "11")
+    ]
+    messages = [
+        (0, datetime(2022, 1, 1, 12, tzinfo=TZ), "今天天气不错"),
+        (1, datetime(2022, 1, 1, 13, tzinfo=TZ), "明天天气也不错"),
+        # 恰好在当天开始时发送的消息
+        (0, datetime(2022, 1, 2, tzinfo=TZ), "天气预报说要下雨"),
+        (1, datetime(2022, 1, 2, 12, tzinfo=TZ), "/今日词云"),
+        (1, datetime(2022, 1, 3, 9, tzinfo=TZ), "下雨天气真冷"),
+    ]
+    async with get_session() as db_session:
+        db_session.add_all(
+            MessageRecord(
+                session_persist_id=session_ids[index],
+                time=time.astimezone(ZoneInfo("UTC")).replace(tzinfo=None),
+                type="message",
+                message_id=str(i),
+                message=[],
+                plain_text=plain_text,
+            )
+            for i, (index, time, plain_text) in enumerate(messages)
+        )
+        await db_session.commit()
+
+
+@pytest.mark.usefixtures("_message_record")
+async def test_rollup_word_counts(app: App, mocker: MockerFixture):
+    """测试按天汇总已经结束的日期的词频"""
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import select
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.model import DailyRollup, DailyWordCount
+    from nonebot_plugin_wordcloud.rollup import rollup_word_counts
+
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 3)
+    mocker.patch(
+        "nonebot_plugin_wordcloud.rollup.get_datetime_now_with_timezone",
+        return_value=datetime(2022, 1, 3, 10, tzinfo=TZ),
+    )
+
+    await rollup_word_counts()
+
+    async with get_session() as db_session:
+        days = await db_session.scalars(select(DailyRollup.day))
+        assert set(days) == {date(2021, 12, 31), date(2022, 1, 1), date(2022, 1, 2)}
+        rows = (
+            await db_session.execute(
+                select(DailyWordCount.day, DailyWordCount.counts).order_by(
+                    DailyWordCount.id
+                )
+            )
+        ).all()
+    assert sorted(day for day, _ in rows) == [
+        date(2022, 1, 1),
+        date(2022, 1, 1),
+        date(2022, 1, 2),
+    ]
+    assert {"天气预报": 1, "下雨": 1} in [counts for _, counts in rows]
+
+    # 分析参数变化后重新汇总
+    mocker.patch.object(
+        plugin_config, "wordcloud_analyzer_options", {"allowPOS": ["n"]}
+    )
+    await rollup_word_counts()
+
+    async with get_session() as db_session:
+        fingerprints = set(await db_session.scalars(select(DailyRollup.fingerprint)))
+    assert len(fingerprints) == 1
+
+
+@pytest.mark.usefixtures("_message_record")
+@pytest.mark.parametrize("user_ids", [None, ["10"]])
+async def test_iter_message_batches(
+    app: App, mocker: MockerFixture, user_ids: list[str] | None
+):
+    """测试使用汇总的词频与直接读取消息的结果相同"""
+    from collections import Counter
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        analyse_message_batches,
+        iter_messages_plain_text,
+    )
+    from nonebot_plugin_wordcloud.rollup import (
+        iter_message_batches,
+        rollup_word_counts,
+    )
+
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 3)
+    mocker.patch(
+        "nonebot_plugin_wordcloud.rollup.get_datetime_now_with_timezone",
+        return_value=datetime(2022, 1, 3, 10, tzinfo=TZ),
+    )
+    await rollup_word_counts()
+
+    kwargs = {
+        "types": ["message"],
+        "time_start": datetime(2022, 1, 1, 6, tzinfo=TZ),
+        "time_stop": datetime(2022, 1, 3, 10, tzinfo=TZ),
+        "user_ids": user_ids,
+    }
+    batches = [batch async for batch in iter_message_batches(**kwargs)]
+    assert [isinstance(batch, Counter) for batch in batches][:2] == [False, True]
+
+    async def iter_batches():
+        for batch in batches:
+            yield batch
+
+    assert await analyse_message_batches(iter_batches()) == pytest.approx(
+        await analyse_message_batches(iter_messages_plain_text(**kwargs))
+    )
+
+    # 未开启汇总时直接读取消息
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 0)
+    batches = [batch async for batch in iter_message_batches(**kwargs)]
+    assert not any(isinstance(batch, Counter) for batch in batches)
+
+
+async def test_rollup_repeat_limit(app: App, mocker: MockerFixture):
+    """测试限制复读消息计入次数时不使用汇总，多个用户的复读只计入一次"""
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_orm import get_session
+    from nonebot_plugin_uninfo import (
+        Scene,
+        SceneType,
+        Session,
+        SupportAdapter,
+        SupportScope,
+        User,
+    )
+    from nonebot_plugin_uninfo.orm import get_session_persist_id
+    from sqlalchemy import select
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        _iter_single_batch,
+        analyse_message_batches,
+    )
+    from nonebot_plugin_wordcloud.model import DailyRollup
+    from nonebot_plugin_wordcloud.rollup import (
+        iter_message_batches,
+        rollup_word_counts,
+    )
+
+    async with get_session() as db_session:
+        for i, user_id in enumerate(("10", "11", "12")):
+            session_id = await get_session_persist_id(
+                Session(
+                    self_id="test",
+                    adapter=SupportAdapter.onebot11,
+                    scope=SupportScope.qq_client,
+                    scene=Scene("10000", SceneType.GROUP),
+                    user=User(user_id),
+                )
+            )
+            db_session.add(
+                MessageRecord(
+                    session_persist_id=session_id,
+                    time=datetime(2022, 1, 1, 12, i, tzinfo=TZ)
+                    .astimezone(ZoneInfo("UTC"))
+                    .replace(tzinfo=None),
+                    type="message",
+                    message_id=str(i),
+                    message=[],
+                    plain_text="今天天气不错",
+                )
+            )
+        await db_session.commit()
+
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 3)
+    mocker.patch.object(plugin_config, "wordcloud_repeat_limit", 1)
+    mocker.patch(
+        "nonebot_plugin_wordcloud.rollup.get_datetime_now_with_timezone",
+        return_value=datetime(2022, 1, 3, 10, tzinfo=TZ),
+    )
+    await rollup_word_counts()
+
+    async with get_session() as db_session:
+        assert not list(await db_session.scalars(select(DailyRollup.day)))
+
+    batches = iter_message_batches(
+        types=["message"],
+        time_start=datetime(2022, 1, 1, tzinfo=TZ),
+        time_stop=datetime(2022, 1, 3, 10, tzinfo=TZ),
+    )
+    # 与只发送了一次相同
+    assert await analyse_message_batches(batches) == pytest.approx(
+        await analyse_message_batches(_iter_single_batch(["今天天气不错"]))
+    )
+
+
+async def test_start_rollup(app: App, mocker: MockerFixture):
+    """测试开启汇总时添加定时任务并在后台汇总"""
+    from nonebot_plugin_apscheduler import scheduler
+
+    from nonebot_plugin_wordcloud import rollup
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 0)
+    await rollup.start_rollup()
+    assert scheduler.get_job(rollup.ROLLUP_JOB_ID) is None
+
+    mocker.patch.object(plugin_config, "wordcloud_rollup_days", 30)
+    await rollup.start_rollup()
+    for task in list(rollup._background_tasks):
+        await task
+
+    assert scheduler.get_job(rollup.ROLLUP_JOB_ID) is not None
+    assert not rollup._background_tasks
+    scheduler.remove_job(rollup.ROLLUP_JOB_ID)
@@ -550,17 +550,19 @@ async def test_schedule_status(app: App):
 
 async def test_run_task_group(app: App, mocker: MockerFixture):
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     image = BytesIO(b"test")
     target = make_group_target(group_id=10000)
     await schedule_service.add_schedule(target)
 
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
 
     async with app.test_api() as ctx:
@@ -569,17 +571,22 @@ async def test_run_task_group(app: App, mocker: MockerFixture):
         should_send_group_image(ctx, image, group_id=10000)
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text.assert_called_once()
-    mocked_get_wordcloud.assert_called_once_with(["test"], "QQClient_10000")
+    mocked_iter_message_batches.assert_called_once()
+    mocked_render_wordcloud.assert_called_once_with(
+        analyse_message("test"),
+        "QQClient_10000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
     # OneBot V12
-    mocked_get_messages_plain_text_v12 = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches_v12 = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
 
-    mocked_get_wordcloud_v12 = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud_v12 = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
 
     async with app.test_api() as ctx:
@@ -588,13 +595,20 @@ async def test_run_task_group(app: App, mocker: MockerFixture):
         should_send_group_image_v12(ctx, image, group_id="10000")
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text_v12.assert_called_once()
-    mocked_get_wordcloud_v12.assert_called_once_with(["test"], "QQClient_10000")
+    mocked_iter_message_batches_v12.assert_called_once()
+    mocked_render_wordcloud_v12.assert_called_once_with(
+        analyse_message("test"),
+        "QQClient_10000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
 
 async def test_run_task_week(app: App, mocker: MockerFixture):
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.model import ScheduleType
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     image = BytesIO(b"test")
     target = make_group_target(group_id=10000)
@@ -605,12 +619,12 @@ async def test_run_task_week(app: App, mocker: MockerFixture):
         "nonebot_plugin_wordcloud.schedule.get_datetime_now_with_timezone",
         return_value=dt,
     )
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
 
     async with app.test_api() as ctx:
@@ -619,11 +633,16 @@ async def test_run_task_week(app: App, mocker: MockerFixture):
         should_send_group_image(ctx, image, group_id=10000)
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text.assert_called_once()
-    kwargs = mocked_get_messages_plain_text.call_args.kwargs
+    mocked_iter_message_batches.assert_called_once()
+    kwargs = mocked_iter_message_batches.call_args.kwargs
     assert kwargs["time_start"] == datetime(2024, 4, 29)
     assert kwargs["time_stop"] == datetime(2024, 5, 6)
-    mocked_get_wordcloud.assert_called_once_with(["test"], "QQClient_10000")
+    mocked_render_wordcloud.assert_called_once_with(
+        analyse_message("test"),
+        "QQClient_10000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
 
 async def test_run_task_week_not_due(app: App, mocker: MockerFixture):
@@ -637,8 +656,8 @@ async def test_run_task_week_not_due(app: App, mocker: MockerFixture):
         "nonebot_plugin_wordcloud.schedule.get_datetime_now_with_timezone",
         return_value=datetime(2024, 5, 7, 22),
     )
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
 
@@ -647,12 +666,14 @@ async def test_run_task_week_not_due(app: App, mocker: MockerFixture):
         ctx.create_bot(base=Bot, adapter=adapter)
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text.assert_not_called()
+    mocked_iter_message_batches.assert_not_called()
 
 
 async def test_run_task_week_period_end(app: App, mocker: MockerFixture):
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.model import ScheduleMode, ScheduleType
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     image = BytesIO(b"test")
     target = make_group_target(group_id=10000)
@@ -667,12 +688,12 @@ async def test_run_task_week_period_end(app: App, mocker: MockerFixture):
         "nonebot_plugin_wordcloud.schedule.get_datetime_now_with_timezone",
         return_value=dt,
     )
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
 
     async with app.test_api() as ctx:
@@ -681,26 +702,33 @@ async def test_run_task_week_period_end(app: App, mocker: MockerFixture):
         should_send_group_image(ctx, image, group_id=10000)
         await schedule_service.run_task(schedule_mode=ScheduleMode.PERIOD_END)
 
-    mocked_get_messages_plain_text.assert_called_once()
-    kwargs = mocked_get_messages_plain_text.call_args.kwargs
+    mocked_iter_message_batches.assert_called_once()
+    kwargs = mocked_iter_message_batches.call_args.kwargs
     assert kwargs["time_start"] == datetime(2024, 5, 6)
     assert kwargs["time_stop"] == dt
-    mocked_get_wordcloud.assert_called_once_with(["test"], "QQClient_10000")
+    mocked_render_wordcloud.assert_called_once_with(
+        analyse_message("test"),
+        "QQClient_10000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
 
 async def test_run_task_channel(app: App, mocker: MockerFixture):
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     image = BytesIO(b"test")
     target = make_channel_target(channel_id=100000)
     await schedule_service.add_schedule(target)
 
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud_v12 = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud_v12 = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
 
     async with app.test_api() as ctx:
@@ -709,22 +737,29 @@ async def test_run_task_channel(app: App, mocker: MockerFixture):
         should_send_channel_image_v12(ctx, image, guild_id="10000", channel_id="100000")
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text.assert_called_once()
-    mocked_get_wordcloud_v12.assert_called_once_with(["test"], "QQGuild_10000_100000")
+    mocked_iter_message_batches.assert_called_once()
+    mocked_render_wordcloud_v12.assert_called_once_with(
+        analyse_message("test"),
+        "QQGuild_10000_100000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
 
 async def test_run_task_without_data(app: App, mocker: MockerFixture):
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     target = make_group_target(group_id=10000)
     await schedule_service.add_schedule(target)
 
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=None
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=None
     )
 
     async with app.test_api() as ctx:
@@ -733,8 +768,13 @@ async def test_run_task_without_data(app: App, mocker: MockerFixture):
         should_send_group_text(ctx, "这段时间没有足够的数据生成词云", group_id=10000)
         await schedule_service.run_task()
 
-    mocked_get_messages_plain_text.assert_called_once()
-    mocked_get_wordcloud.assert_called_once_with(["test"], "QQClient_10000")
+    mocked_iter_message_batches.assert_called_once()
+    mocked_render_wordcloud.assert_called_once_with(
+        analyse_message("test"),
+        "QQClient_10000",
+        priority=RenderPriority.SCHEDULED,
+        preset="quality",
+    )
 
 
 async def test_run_task_remove_schedule(app: App):
@@ -771,6 +811,8 @@ async def test_run_task_remove_schedule(app: App):
 async def test_run_task_send_error(app: App, mocker: MockerFixture):
     """发送时出现错误"""
     from nonebot_plugin_wordcloud import schedule_service
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
+    from nonebot_plugin_wordcloud.render import RenderPriority
 
     image = BytesIO(b"test")
     target = make_group_target(group_id=10000)
@@ -778,12 +820,12 @@ async def test_run_task_send_error(app: App, mocker: MockerFixture):
     await schedule_service.add_schedule(target)
     await schedule_service.add_schedule(target2)
 
-    mocked_get_messages_plain_text = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_messages_plain_text",
+    mocked_iter_message_batches = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
         return_value=["test"],
     )
-    mocked_get_wordcloud = mocker.patch(
-        "nonebot_plugin_wordcloud.schedule.get_wordcloud", return_value=image
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
     )
     mocked_get_datetime_now_with_timezone = mocker.patch(
         "nonebot_plugin_wordcloud.schedule.get_datetime_now_with_timezone",
@@ -800,11 +842,68 @@ async def test_run_task_send_error(app: App, mocker: MockerFixture):
         should_send_group_image(ctx, image, group_id=10001)
         await schedule_service.run_task()
 
-    assert mocked_get_messages_plain_text.call_count == 2
+    assert mocked_iter_message_batches.call_count == 2
     mocked_get_datetime_now_with_timezone.assert_called_once()
-    mocked_get_wordcloud.assert_has_calls(
+    mocked_render_wordcloud.assert_has_calls(
         [
-            mocker.call(["test"], "QQClient_10000"),
-            mocker.call(["test"], "QQClient_10001"),
+            mocker.call(
+                analyse_message("test"),
+                "QQClient_10000",
+                priority=RenderPriority.SCHEDULED,
+                preset="quality",
+            ),
+            mocker.call(
+                analyse_message("test"),
+                "QQClient_10001",
+                priority=RenderPriority.SCHEDULED,
+                preset="quality",
+            ),
         ]  # type: ignore
     )
+
+
+async def test_run_task_analyse_many(app: App, mocker: MockerFixture):
+    """按组一起分析需要发送的会话，已经缓存的会话不再分析"""
+    from nonebot_plugin_wordcloud import schedule, schedule_service
+    from nonebot_plugin_wordcloud.cache import wordcloud_cache
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud_cache_key
+    from nonebot_plugin_wordcloud.model import ScheduleType
+    from nonebot_plugin_wordcloud.schedule import get_schedule_time_range
+
+    image = b"test"
+    cached_image = b"cached"
+    for group_id in (10000, 10001, 10002):
+        await schedule_service.add_schedule(make_group_target(group_id=group_id))
+
+    dt = datetime(2024, 5, 6, 22)
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 64)
+    mocker.patch.object(schedule, "SCHEDULE_ANALYSE_CHUNK_SIZE", 2)
+    mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.get_datetime_now_with_timezone",
+        return_value=dt,
+    )
+    mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.iter_message_batches",
+        return_value=["test"],
+    )
+    mocked_render_wordcloud = mocker.patch(
+        "nonebot_plugin_wordcloud.schedule.render_wordcloud", return_value=image
+    )
+    spy_analyse_many = mocker.spy(schedule, "analyse_many")
+
+    time_range = get_schedule_time_range(dt, ScheduleType.DAY)
+    assert time_range
+    cache_key, _ = get_wordcloud_cache_key("QQClient_10001", *time_range)
+    await wordcloud_cache.set(cache_key, cached_image)
+
+    async with app.test_api() as ctx:
+        adapter = get_adapter(Adapter)
+        ctx.create_bot(base=Bot, adapter=adapter)
+        should_send_group_image(ctx, image, group_id=10000)
+        should_send_group_image(ctx, cached_image, group_id=10001)
+        should_send_group_image(ctx, image, group_id=10002)
+        await schedule_service.run_task()
+
+    assert [len(call.args[0]) for call in spy_analyse_many.call_args_list] == [1, 1]
+    assert mocked_render_wordcloud.call_count == 2
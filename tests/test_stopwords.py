@@ -5,8 +5,8 @@ async def test_stopwords(app: App):
     """测试设置停用词表"""
     from nonebot_plugin_localstore import get_data_file
 
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     data = get_data_file("nonebot_plugin_wordcloud", "stopwords.txt")
     with data.open("w", encoding="utf8") as f:
@@ -6,8 +6,8 @@ async def test_userdict(app: App, mocker: MockerFixture):
     """测试添加用户词典"""
     from nonebot_plugin_localstore import get_data_file
 
+    from nonebot_plugin_wordcloud.analyzer import analyse_message
     from nonebot_plugin_wordcloud.config import plugin_config
-    from nonebot_plugin_wordcloud.data_source import analyse_message
 
     data = get_data_file("nonebot_plugin_wordcloud", "userdict.txt")
     with data.open("w", encoding="utf8") as f:
@@ -30,13 +30,14 @@ FAKE_IMAGE = BytesIO(
 )
 
 
-def assert_wordcloud_called_with_unordered(
+async def assert_wordcloud_called_with_unordered(
     mocked_get_wordcloud, expected_messages: set[str], expected_mask_key: str
 ):
     """验证 get_wordcloud 被调用，使用集合比较忽略消息顺序"""
     assert mocked_get_wordcloud.call_count == 1
     call_args = mocked_get_wordcloud.call_args
-    assert set(call_args[0][0]) == expected_messages
+    messages = [message async for batch in call_args[0][0] for message in batch]
+    assert set(messages) == expected_messages
     assert call_args[0][1] == expected_mask_key
 
 
@@ -217,6 +218,237 @@ async def test_get_wordcloud(app: App, mocker: MockerFixture):
     mocked_random.assert_called_once_with()
 
 
+async def test_render_preset(app: App, mocker: MockerFixture):
+    """测试渲染预设在缩小的画布上布局后放大"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        get_render_preset,
+        get_wordcloud,
+        get_wordcloud_options,
+    )
+
+    options = get_wordcloud_options("fast")
+    assert (options["width"], options["height"], options["scale"]) == (480, 300, 4)
+    options = get_wordcloud_options("balanced")
+    assert (options["width"], options["height"], options["scale"]) == (960, 600, 2)
+    assert "scale" not in get_wordcloud_options("quality")
+
+    image_byte = await get_wordcloud(["天气"], "", preset="fast")
+    assert image_byte is not None
+    assert PILImage.open(BytesIO(image_byte)).size == (1920, 1200)
+
+    start = datetime(2022, 1, 1)
+    assert get_render_preset("QQClient_10000", start, datetime(2022, 1, 2)) == "quality"
+    # 时间范围较大时自动切换
+    assert (
+        get_render_preset("QQClient_10000", start, datetime(2023, 1, 1)) == "balanced"
+    )
+    # 会话单独设置的预设优先
+    mocker.patch.object(
+        plugin_config, "wordcloud_render_preset_scenes", {"QQClient_10000": "fast"}
+    )
+    assert get_render_preset("QQClient_10000", start, datetime(2023, 1, 1)) == "fast"
+    assert get_render_preset("QQClient_10001", start, datetime(2022, 1, 2)) == "quality"
+
+
+@pytest.mark.parametrize(
+    ("image_format", "save_options", "pil_format"),
+    [
+        ("png", {"compress_level": 1}, "PNG"),
+        ("webp", {"lossless": True}, "WEBP"),
+        ("jpeg", {"quality": 80}, "JPEG"),
+    ],
+)
+async def test_get_wordcloud_image_format(
+    app: App,
+    mocker: MockerFixture,
+    image_format: str,
+    save_options: dict,
+    pil_format: str,
+):
+    """测试按配置的格式编码图片"""
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud
+
+    mocker.patch.object(plugin_config, "wordcloud_image_format", image_format)
+    mocker.patch.object(plugin_config, "wordcloud_image_save_options", save_options)
+
+    image_byte = await get_wordcloud(["天气"], "", preset="fast")
+
+    assert image_byte is not None
+    image = PILImage.open(BytesIO(image_byte))
+    assert image.format == pil_format
+    assert image.size == (1920, 1200)
+
+
+async def test_wordcloud_cmd_image_format(app: App, mocker: MockerFixture):
+    """测试发送的图片文件名与格式一致"""
+    from nonebot_plugin_wordcloud import wordcloud_cmd
+    from nonebot_plugin_wordcloud.config import plugin_config
+
+    mocker.patch.object(plugin_config, "wordcloud_image_format", "jpeg")
+    mocker.patch("nonebot_plugin_wordcloud.iter_message_batches", return_value=["天气"])
+    mocker.patch("nonebot_plugin_wordcloud.get_wordcloud", return_value=b"image")
+
+    async with app.test_matcher(wordcloud_cmd) as ctx:
+        adapter = get_adapter(AdapterV12)
+        bot = ctx.create_bot(
+            base=BotV12,
+            adapter=adapter,
+            auto_connect=False,
+            platform="test",
+            impl="test",
+        )
+        event = fake_channel_message_event_v12(message=MessageV12("/今日词云"))
+
+        ctx.receive_event(bot, event)
+        should_send_image(ctx, bot, event, b"image", name="wordcloud.jpg")
+        ctx.should_finished(wordcloud_cmd)
+
+
+async def test_font_cache(app: App, mocker: MockerFixture):
+    """测试多次渲染之间复用字体对象"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from PIL import ImageFont
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import (
+        _get_wordcloud,
+        _render_context,
+        get_wordcloud_options,
+    )
+
+    frequency = {f"词语{i}": 1 / (i + 1) for i in range(50)}
+    options = get_wordcloud_options("fast")
+    options["random_state"] = 0
+
+    mocker.patch.object(plugin_config, "wordcloud_font_cache_size", 0)
+    uncached = _get_wordcloud(frequency, options, None)
+    assert _render_context.font_loads == 0
+
+    import wordcloud.wordcloud
+
+    mocker.patch.object(plugin_config, "wordcloud_font_cache_size", 1024)
+    wordcloud.wordcloud.ImageFont.clear()
+    first = _get_wordcloud(frequency, options, None)
+    assert _render_context.font_loads > 0
+    second = _get_wordcloud(frequency, options, None)
+    assert _render_context.font_loads == 0
+    assert first == second == uncached
+
+    # 所有渲染线程共用字体对象
+    def render_in_thread():
+        image = _get_wordcloud(frequency, options, None)
+        return image, _render_context.font_loads
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda _: render_in_thread(), range(2)))
+    assert results == [(first, 0), (first, 0)]
+
+    # 缓存放不下所有字号时保留小字号，多次渲染之间仍然可以复用
+    mocker.patch.object(plugin_config, "wordcloud_font_cache_size", 64)
+    wordcloud.wordcloud.ImageFont.clear()
+    _get_wordcloud(frequency, options, None)
+    first_loads = _render_context.font_loads
+    sizes = sorted(size for _, size in wordcloud.wordcloud.ImageFont._fonts)
+    assert len(sizes) == 64
+    _get_wordcloud(frequency, options, None)
+    assert _render_context.font_loads <= first_loads - 32
+    assert sorted(size for _, size in wordcloud.wordcloud.ImageFont._fonts) == sizes
+
+    # 插件渲染以外不使用缓存
+    font_path = options["font_path"]
+    assert wordcloud.wordcloud.ImageFont.truetype(
+        font_path, 20
+    ) is not wordcloud.wordcloud.ImageFont.truetype(font_path, 20)
+    assert wordcloud.wordcloud.ImageFont.FreeTypeFont is ImageFont.FreeTypeFont
+
+
+async def test_get_wordcloud_timeout(app: App, mocker: MockerFixture):
+    """测试渲染超时后使用简化参数重新生成"""
+    import asyncio
+
+    from nonebot_plugin_wordcloud.cache import FallbackImage
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import get_wordcloud
+
+    mocker.patch.object(plugin_config, "wordcloud_render_timeout", 10)
+    mask_path = Path("mask.png")
+    mocker.patch(
+        "nonebot_plugin_wordcloud.data_source.get_mask_path", return_value=mask_path
+    )
+    mocked_run = mocker.patch(
+        "nonebot_plugin_wordcloud.data_source.render_pool.run",
+        side_effect=[asyncio.TimeoutError, b"fallback"],
+    )
+
+    image = await get_wordcloud(["天气"], "")
+    assert image == b"fallback"
+    assert isinstance(image, FallbackImage)
+
+    assert mocked_run.call_count == 2
+    first, second = mocked_run.call_args_list
+    assert first.kwargs == {"timeout": 10}
+    assert first.args[3] == mask_path
+    options = first.args[2]
+    fallback_options, fallback_mask_path = second.args[2:4]
+    # 降级生成时仍然使用 mask
+    assert fallback_mask_path == mask_path
+    assert fallback_options["max_words"] == 50
+    assert fallback_options["width"] == options["width"] // 2
+    assert fallback_options["height"] == options["height"] // 2
+    assert fallback_options["scale"] == 2
+
+    # 简化后仍然超时
+    mocked_run.side_effect = asyncio.TimeoutError
+    assert await get_wordcloud(["天气"], "") is None
+
+
+async def test_get_wordcloud_timeout_not_cached(app: App, mocker: MockerFixture):
+    """测试渲染超时后使用简化参数生成，且图片只短暂缓存在内存中"""
+    import asyncio
+    import time
+
+    from nonebot_plugin_wordcloud import data_source
+    from nonebot_plugin_wordcloud.cache import FallbackImage, wordcloud_cache
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.render import RenderPool, render_limiter
+
+    # 只有一个工作线程时，简化生成不会排在超时的任务之后
+    mocker.patch.object(plugin_config, "wordcloud_render_workers", 1)
+    pool = RenderPool(render_limiter)
+    mocker.patch.object(data_source, "render_pool", pool)
+    mocker.patch.object(plugin_config, "wordcloud_render_timeout", 0.5)
+    mocker.patch.object(plugin_config, "wordcloud_cache_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_cache_disk_size", 1)
+    mocker.patch.object(plugin_config, "wordcloud_cache_ttl", 60)
+
+    def render(frequency, options, *args):
+        if options.get("max_words", 200) > data_source.FALLBACK_MAX_WORDS:
+            time.sleep(2)
+        return b"image"
+
+    mocker.patch.object(data_source, "_get_wordcloud", new=render)
+
+    # 已经结束的时间段的缓存原本永不过期
+    image = await wordcloud_cache.get_or_create(
+        "closed", lambda: data_source.get_wordcloud(["天气"], "")
+    )
+    assert image == b"image"
+    assert isinstance(image, FallbackImage)
+    assert wordcloud_cache._entries["closed"].expire_at is not None
+    assert not plugin_config.get_cache_path("closed").exists()
+
+    # 等待超时的渲染结束
+    for _ in range(50):
+        if render_limiter.active == 0:
+            break
+        await asyncio.sleep(0.1)
+    assert render_limiter.active == 0
+    pool.shutdown()
+
+
 async def test_get_wordcloud_private(app: App):
     """测试私聊词云"""
     from nonebot_plugin_wordcloud import wordcloud_cmd
@@ -272,6 +504,43 @@ async def test_wordcloud_cmd(app: App):
         ctx.should_finished()
 
 
+@pytest.mark.usefixtures("_message_record")
+async def test_iter_messages_plain_text(app: App, mocker: MockerFixture):
+    """测试分批读取聊天记录"""
+    from nonebot_plugin_chatrecorder import get_messages_plain_text
+
+    from nonebot_plugin_wordcloud.config import plugin_config
+    from nonebot_plugin_wordcloud.data_source import iter_messages_plain_text
+
+    mocker.patch.object(plugin_config, "wordcloud_message_batch_size", 2)
+
+    batches = [batch async for batch in iter_messages_plain_text(types=["message"])]
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 2]
+    assert sorted(message for batch in batches for message in batch) == sorted(
+        await get_messages_plain_text(types=["message"])
+    )
+
+
+async def test_analyse_message_batches(app: App):
+    """测试逐批统计的结果与一次性分析相同"""
+    from nonebot_plugin_wordcloud.data_source import (
+        analyse_message_batches,
+        analyse_messages,
+    )
+
+    messages = ["今天天气不错", "/今日词云", "明天天气也不错", "今天天气真不错"]
+
+    async def iter_batches():
+        yield messages[:2]
+        yield messages[2:]
+
+    frequency = await analyse_message_batches(iter_batches())
+
+    assert frequency == pytest.approx(analyse_messages(messages))
+    assert "今日" not in frequency
+
+
 @pytest.mark.usefixtures("_message_record")
 async def test_today_wordcloud(app: App, mocker: MockerFixture):
     """测试今日词云"""
@@ -309,7 +578,7 @@ async def test_today_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -349,7 +618,7 @@ async def test_my_today_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2"},
         "QQClient_10000",
@@ -395,7 +664,7 @@ async def test_today_wordcloud_at_user(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"11:1-2"},
         "QQClient_10000",
@@ -465,7 +734,7 @@ async def test_today_wordcloud_at_self(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2"},
         "QQClient_10000",
@@ -504,7 +773,7 @@ async def test_yesterday_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -544,7 +813,7 @@ async def test_my_yesterday_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2"},
         "QQClient_10000",
@@ -583,7 +852,7 @@ async def test_week_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-3", "11:1-3"},
         "QQClient_10000",
@@ -622,7 +891,7 @@ async def test_last_week_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -661,7 +930,7 @@ async def test_month_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:2-1", "11:2-1"},
         "QQClient_10000",
@@ -701,7 +970,7 @@ async def test_last_month_wordcloud(app: App, mocker: MockerFixture):
 
     mocked_datetime_now.assert_called_once_with()
     # 验证调用参数，使用集合比较忽略顺序
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2", "10:1-3", "11:1-3"},
         "QQClient_10000",
@@ -741,7 +1010,7 @@ async def test_year_wordcloud(app: App, mocker: MockerFixture):
 
     mocked_datetime_now.assert_called_once_with()
     # 验证调用参数，使用集合比较忽略顺序
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2", "10:1-3", "11:1-3", "10:2-1", "11:2-1"},
         "QQClient_10000",
@@ -781,7 +1050,7 @@ async def test_my_year_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "10:1-3", "10:2-1"},
         "QQClient_10000",
@@ -814,7 +1083,7 @@ async def test_history_wordcloud(app: App, mocker: MockerFixture):
         )
         ctx.should_finished()
 
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -850,7 +1119,7 @@ async def test_history_wordcloud_start_stop(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     # 验证调用参数，使用集合比较忽略顺序
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-3", "11:1-3", "10:2-1", "11:2-1"},
         "QQClient_10000",
@@ -903,7 +1172,7 @@ async def test_history_wordcloud_start_stop_get_args(app: App, mocker: MockerFix
         ctx.should_finished()
 
     # 验证调用参数，使用集合比较忽略顺序
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2", "10:1-3", "11:1-3", "10:2-1", "11:2-1"},
         "QQClient_10000",
@@ -981,7 +1250,7 @@ async def test_today_wordcloud_v12(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"v12-10:1-2", "v12-11:1-2"},
         "QQGuild_10000_100000",
@@ -1025,7 +1294,7 @@ async def test_my_today_wordcloud_v12(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"v12-10:1-2"},
         "QQGuild_10000_100000",
@@ -1069,7 +1338,7 @@ async def test_today_wordcloud_qq_group_v12(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -1110,7 +1379,7 @@ async def test_today_wordcloud_exclude_user_ids(app: App, mocker: MockerFixture)
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"11:1-2"},
         "QQClient_10000",
@@ -1157,7 +1426,7 @@ async def test_today_wordcloud_reply_message(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -1196,7 +1465,7 @@ async def test_group_today_wordcloud(app: App, mocker: MockerFixture):
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2"},
         "QQClient_10000",
@@ -1236,7 +1505,7 @@ async def test_group_year_wordcloud(app: App, mocker: MockerFixture):
 
     mocked_datetime_now.assert_called_once_with()
     # 验证调用参数，使用集合比较忽略顺序
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2", "11:1-2", "10:1-3", "11:1-3", "10:2-1", "11:2-1"},
         "QQClient_10000",
@@ -1279,7 +1548,7 @@ async def test_config_default_personal_behavior(app: App, mocker: MockerFixture)
         ctx.should_finished()
 
     mocked_datetime_now.assert_called_once_with()
-    assert_wordcloud_called_with_unordered(
+    await assert_wordcloud_called_with_unordered(
         mocked_get_wordcloud,
         {"10:1-2"},
         "QQClient_10000",